@@ -2,18 +2,19 @@ from dotenv import load_dotenv
 load_dotenv()  # 加载 .env 文件，override=True 覆盖已有环境变量
 
 import json
-import os
-from openai import OpenAI
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "utils"))
+from llm_client import get_client
 
 # ----------------------
 # 0. 配置客户端
 # ----------------------
 # NewAPI 兼容 OpenAI API，直接用 OpenAI SDK 即可
 # 只需要将 base_url 指向 NewAPI 的地址
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_BASE_URL")
-)
+# get_client() 读取 OPENAI_API_KEY / OPENAI_BASE_URL，整个进程共用一个客户端和连接池（见 utils/llm_client.py）
+client = get_client()
 
 # ----------------------
 # 1. 定义工具 (Python 函数)
@@ -16,6 +16,12 @@ Key learning:
     Phase 1: You manually decided when to call tools.
     Phase 3: The LLM itself decides when to call search_notes.
              This is the core of a real RAG Agent.
+
+Warm-up:
+    Loading the embedding model and opening the collections takes seconds the
+    first time, so they are loaded at startup instead of on the first question.
+    RETRIEVER_WARMUP=background (default) does it in a background thread,
+    "sync" waits for it before the first prompt, "off" skips it.
 """
 
 from __future__ import annotations
@@ -23,16 +29,21 @@ from __future__ import annotations
 import json
 import os
 import sys
+import threading
+from pathlib import Path
 from typing import Annotated, Any
 
 from dotenv import load_dotenv
 from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.graph import END, StateGraph
 from langgraph.graph.message import add_messages
-from openai import OpenAI
 from pydantic import BaseModel, Field
 
-from retriever import SEARCH_TOOL_SCHEMA, run_search_tool
+from retriever import SEARCH_TOOL_SCHEMA, run_search_tool, warm_up
+
+# Shared OpenAI client (one connection pool per process), see utils/llm_client.py
+sys.path.insert(0, str(Path(__file__).parent.parent / "utils"))
+from llm_client import get_client  # noqa: E402
 
 load_dotenv(override=True)
 
@@ -46,6 +57,7 @@ for stream_name in ("stdin", "stdout", "stderr"):
             pass
 
 CHAT_MODEL = os.getenv("CHAT_MODEL", "MiniMax-M2.5")
+RETRIEVER_WARMUP = os.getenv("RETRIEVER_WARMUP", "background")
 
 # Debug: 确认当前使用的配置
 print("--- [DEBUG CONFIG] ---")
@@ -58,13 +70,6 @@ print(f"MODEL: {CHAT_MODEL}")
 print("----------------------\n")
 
 
-def get_client() -> OpenAI:
-    return OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL"),
-    )
-
-
 # ---------------------------------------------------------------------------
 # State
 # ---------------------------------------------------------------------------
@@ -401,7 +406,26 @@ def build_app():
 # ---------------------------------------------------------------------------
 # Main CLI
 # ---------------------------------------------------------------------------
+def warm_up_retriever() -> None:
+    """Preload the retriever (model, collections, one dummy query) and report the time."""
+    try:
+        t = warm_up()
+    except Exception as e:
+        print(f"[系统日志] 检索预热失败（首次检索时再加载）: {e}")
+        return
+    print(
+        f"[系统日志] 检索预热完成 {t['total_ms']:.0f} ms"
+        f"（模型 {t['model_ms']:.0f} ms，{t['collections']:.0f} 个 collection {t['collections_ms']:.0f} ms，"
+        f"试查询 {t['query_ms']:.0f} ms）"
+    )
+
+
 def main():
+    if RETRIEVER_WARMUP == "sync":
+        warm_up_retriever()
+    elif RETRIEVER_WARMUP != "off":
+        threading.Thread(target=warm_up_retriever, name="retriever-warmup", daemon=True).start()
+
     print("Phase 3 RAG Agent - 输入 quit 退出")
     print("提示：可以问我关于 MCP、LangGraph、Function Calling、Embedding 的问题\n")
 
@@ -0,0 +1,167 @@
+"""
+Phase 3 - Retrieval micro-benchmarks
+
+Usage:
+    uv run python phase-3/bench.py embed --chunks 4000 --workers 1,2,4,8
+    uv run python phase-3/bench.py chunk --mb 8
+    uv run python phase-3/bench.py backend --sizes 500,5000,50000
+
+Benchmarks:
+    embed   Embedding throughput of the ingest pipeline for 1..N worker
+            processes (synthetic chunks cut from notes/, nothing is written
+            to ChromaDB). Includes pool start-up and model load per worker.
+    chunk   Chunker speed and peak memory over a multi-MB synthetic Markdown
+            file: the original list-building chunk_text vs. the offset
+            generator vs. the Markdown chunker.
+    backend Vector query latency (p50 / p99) of Chroma's HNSW index vs. the
+            NumPy brute-force index on random unit vectors, per corpus size.
+            Use it to pick NUMPY_MAX_CHUNKS for SEARCH_BACKEND=auto.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+from collections import deque
+from typing import Callable, Iterable
+
+import chromadb
+import numpy as np
+
+import ingest
+from vector_index import NumpyIndex
+
+
+def _synthetic_chunks(n: int) -> list[dict]:
+    """n distinct chunk records cut from the real notes (numbered so none repeat)."""
+    base = [c for f in sorted(ingest.NOTES_DIR.glob("*.md")) for c in ingest.chunk_text(f.read_text(encoding="utf-8"))]
+    records = []
+    for i in range(n):
+        doc = f"{base[i % len(base)]}\n#{i}"
+        records.append({"id": f"bench_{i}", "document": doc, "metadata": {}, "hash": ingest._sha256(doc)})
+    return records
+
+
+def bench_embed(chunks: int, workers: list[int], batch_size: int) -> None:
+    records = _synthetic_chunks(chunks)
+    print(f"{'workers':>8} | {'seconds':>8} | {'chunks/s':>9} | speedup")
+    baseline = None
+    for w in workers:
+        started = time.perf_counter()
+        batches = ingest._embed_batches(None, ingest._batched(records, batch_size), {}, {}, workers=w)
+        done = sum(len(batch) for batch, _ in batches)
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        print(f"{w:>8} | {elapsed:>8.2f} | {done / elapsed:>9.1f} | {baseline / elapsed:.2f}x")
+
+
+def _chunk_text_v0(text: str, chunk_size: int, overlap: int) -> list[str]:
+    """The original implementation, kept as the baseline."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start += chunk_size - overlap
+    return chunks
+
+
+def _synthetic_markdown(mb: float) -> str:
+    notes = "\n\n".join(f.read_text(encoding="utf-8") for f in sorted(ingest.NOTES_DIR.glob("*.md")))
+    return notes * max(1, int(mb * 1024 * 1024 / len(notes.encode("utf-8"))))
+
+
+def bench_chunk(mb: float) -> None:
+    text = _synthetic_markdown(mb)
+    size, overlap = ingest.CHUNK_SIZE, ingest.CHUNK_OVERLAP
+    cases: dict[str, Callable[[], Iterable]] = {
+        "v0 list+strip": lambda: _chunk_text_v0(text, size, overlap),
+        "offset spans": lambda: ingest.iter_chunk_spans(text, size, overlap),
+        "chunk_text (lazy)": lambda: ingest.chunk_text(text, size, overlap),
+        "markdown": lambda: ingest.iter_markdown_chunks(text),
+    }
+    print(f"synthetic Markdown: {len(text.encode('utf-8')) / 1e6:.1f} MB, {len(text)} chars\n")
+    print(f"{'chunker':<18} | {'chunks':>7} | {'seconds':>7} | {'MB/s':>7} | peak extra memory")
+    for name, make in cases.items():
+        started = time.perf_counter()
+        count = sum(1 for _ in make())
+        elapsed = time.perf_counter() - started
+
+        # Second pass just for memory: consume the chunks the way ingest does
+        tracemalloc.start()
+        deque(make(), maxlen=0)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        mbps = len(text.encode("utf-8")) / 1e6 / elapsed
+        print(f"{name:<18} | {count:>7} | {elapsed:>7.3f} | {mbps:>7.1f} | {peak / 1e6:.1f} MB")
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def bench_backend(sizes: list[int], queries: int, top_k: int, dim: int = 384) -> None:
+    rng = np.random.default_rng(0)
+    client = chromadb.EphemeralClient()
+    print(f"{'chunks':>7} | {'backend':<7} | {'p50 ms':>7} | {'p99 ms':>7} | build s")
+    for size in sizes:
+        vectors = rng.standard_normal((size, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        probes = rng.standard_normal((queries, dim), dtype=np.float32).tolist()
+        ids = [f"bench_{i}" for i in range(size)]
+
+        started = time.perf_counter()
+        collection = client.create_collection(f"bench-{size}", embedding_function=None)
+        step = client.get_max_batch_size()
+        for i in range(0, size, step):
+            collection.add(ids=ids[i : i + step], embeddings=vectors[i : i + step], documents=ids[i : i + step])
+        chroma_build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = NumpyIndex(ids, ids, [{}] * size, vectors, space="l2")
+        numpy_build = time.perf_counter() - started
+
+        for name, store, build in (("chroma", collection, chroma_build), ("numpy", index, numpy_build)):
+            store.query(query_embeddings=probes[:1], n_results=top_k)  # warm up
+            timings = []
+            for probe in probes:
+                started = time.perf_counter()
+                store.query(query_embeddings=[probe], n_results=top_k, include=["documents", "metadatas", "distances"])
+                timings.append((time.perf_counter() - started) * 1000)
+            p50, p99 = _percentile(timings, 50), _percentile(timings, 99)
+            print(f"{size:>7} | {name:<7} | {p50:>7.2f} | {p99:>7.2f} | {build:.2f}")
+        client.delete_collection(f"bench-{size}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Phase 3 retrieval micro-benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("embed", help="embedding throughput vs. number of worker processes")
+    p.add_argument("--chunks", type=int, default=4000)
+    p.add_argument("--workers", default="1,2,4,8", help="comma separated worker counts")
+    p.add_argument("--batch-size", type=int, default=64)
+
+    p = sub.add_parser("chunk", help="chunker speed / memory on a synthetic Markdown file")
+    p.add_argument("--mb", type=float, default=8.0, help="approximate size of the synthetic file")
+
+    p = sub.add_parser("backend", help="query latency of the Chroma vs. NumPy vector backends")
+    p.add_argument("--sizes", default="500,5000,50000", help="comma separated corpus sizes")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=10)
+
+    args = parser.parse_args()
+    if args.bench == "embed":
+        bench_embed(args.chunks, [int(w) for w in args.workers.split(",")], args.batch_size)
+    elif args.bench == "chunk":
+        bench_chunk(args.mb)
+    elif args.bench == "backend":
+        bench_backend([int(n) for n in args.sizes.split(",")], args.queries, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Phase 3 - Local BM25 index (lexical search)
+
+This module exposes:
+    - tokenize(text) -> list[str]   (CJK-friendly tokenizer shared by ingest and retriever)
+    - BM25Index                     (build / save / load / search)
+
+Why BM25 next to the vector index?
+    MiniLM embeddings capture meaning but are fuzzy about exact identifiers:
+    "finish_reason", "interrupt()" or "Thread ID" often lose to passages that
+    are merely on the same topic. BM25 scores exact term overlap, so fusing
+    both rankings (see retriever.py) gets keyword questions right without
+    inflating top_k.
+
+Tokenization:
+    - Latin words / identifiers are lowercased and kept whole ("finish_reason"),
+      plus their "_"-separated parts ("finish", "reason").
+    - CJK runs have no spaces, so they become unigrams + bigrams
+      ("向量数据库" → 向, 量, ..., 向量, 量数, 数据, 据库).
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Collection, Iterable, Sequence
+
+_WORD_RE = re.compile(r"[a-z0-9_]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def tokenize(text: str) -> list[str]:
+    tokens: list[str] = []
+    for run in _WORD_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        if _CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+            if "_" in run:
+                tokens.extend(part for part in run.split("_") if part)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over an in-memory inverted index (term -> [(doc, tf), ...])."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: list[str] = []
+        self.doc_len: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+
+    @classmethod
+    def from_documents(cls, items: Iterable[tuple[str, str]], **kwargs) -> "BM25Index":
+        """Build from (id, text) pairs; items may be a generator."""
+        index = cls(**kwargs)
+        for doc_id, text in items:
+            doc = len(index.ids)
+            index.ids.append(doc_id)
+            tokens = tokenize(text)
+            index.doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                index.postings.setdefault(term, []).append((doc, tf))
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def idf(self, term: str, corpus: Sequence["BM25Index"] | None = None) -> float:
+        """IDF of term in this index, or in the union of the corpus indexes."""
+        corpus = corpus or [self]
+        n = sum(len(index.ids) for index in corpus)
+        df = sum(len(index.postings.get(term, ())) for index in corpus)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        allowed: Collection[str] | None = None,
+        corpus: Sequence["BM25Index"] | None = None,
+    ) -> list[tuple[str, float]]:
+        """Return [(id, score)] of the best top_k documents, best first.
+
+        allowed restricts scoring to those ids (a metadata pre-filter).
+        corpus (the indexes of all shards, this one included) supplies the IDF
+        and average document length, so the scores of several shards compare
+        as if they were one index.
+        """
+        if not self.ids:
+            return []
+        corpus = corpus or [self]
+        allowed_docs = None
+        if allowed is not None:
+            allowed = set(allowed)
+            allowed_docs = {doc for doc, doc_id in enumerate(self.ids) if doc_id in allowed}
+        avgdl = sum(sum(index.doc_len) for index in corpus) / sum(len(index.ids) for index in corpus) or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term, corpus)
+            for doc, tf in postings:
+                if allowed_docs is not None and doc not in allowed_docs:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc] / avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / norm
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[doc], score) for doc, score in best]
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"k1": self.k1, "b": self.b, "ids": self.ids, "doc_len": self.doc_len, "postings": self.postings}
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "BM25Index":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        index = cls(k1=data["k1"], b=data["b"])
+        index.ids = data["ids"]
+        index.doc_len = data["doc_len"]
+        index.postings = {term: [tuple(p) for p in postings] for term, postings in data["postings"].items()}
+        return index
@@ -0,0 +1,252 @@
+"""
+Phase 3 - Small caches used by the retriever
+
+This module exposes:
+    - normalize_query(text) -> str   (cache key normalization for queries)
+    - LRUCache                       (bounded, thread-safe in-memory LRU with optional TTL)
+    - SQLiteStore                    (optional on-disk tier, shareable across processes)
+    - EmbeddingCache                 (text -> embedding, memory tier in front of disk tier)
+    - ResultCache                    (key -> formatted search result, TTL, memory + disk tiers)
+
+Why cache embeddings?
+    Every query costs one ONNX forward pass of MiniLM. Agents and eval.py
+    ask the same questions again and again, so remembering the vector for a
+    normalized query text lets repeats skip the model entirely.
+
+Why cache results too?
+    A repeated question with the same top_k against the same collection
+    version returns the same passages, so the whole search can be skipped.
+    Keys include the version stamp written by ingest.py, so a re-ingest
+    invalidates every entry without any explicit purge.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Sequence
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """NFKC + lowercase + collapsed whitespace.
+
+    MiniLM's tokenizer is uncased, so lowercasing does not change the vector
+    but lets "MCP 是什么" and "mcp  是什么" share one cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry.
+
+    With ttl (seconds), entries older than ttl are treated as missing.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            expires, value = self._data[key]
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStore:
+    """Namespaced bytes key/value store in a single SQLite file.
+
+    WAL mode lets several processes read and write the same file.
+    """
+
+    def __init__(self, path: str | Path, namespace: str = "default"):
+        self.path = Path(path)
+        self.namespace = namespace
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " PRIMARY KEY (ns, key))"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, bytes]:
+        found: dict[str, bytes] = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                batch = list(keys[i : i + 500])
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM kv WHERE ns = ? AND key IN ({marks})",
+                    [self.namespace, *batch],
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, items: dict[str, bytes]) -> None:
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO kv (ns, key, value) VALUES (?, ?, ?)",
+                [(self.namespace, k, v) for k, v in items.items()],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingCache:
+    """text -> float32 vector, with an in-memory LRU and an optional SQLite tier.
+
+    get_many() embeds all misses in ONE call to embed_fn, so callers can pass
+    a whole batch of texts and still pay a single model forward pass.
+    """
+
+    def __init__(self, maxsize: int = 1024, db_path: str | Path | None = None, namespace: str = "default"):
+        self.memory = LRUCache(maxsize)
+        self.disk = SQLiteStore(db_path, namespace) if db_path else None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    def get_many(self, texts: Sequence[str], embed_fn: Callable[[list[str]], Any]) -> list[np.ndarray]:
+        keys = [text_key(t) for t in texts]
+        first_index: dict[str, int] = {}
+        for i, k in enumerate(keys):
+            first_index.setdefault(k, i)
+
+        found: dict[str, np.ndarray] = {}
+        for k in first_index:
+            vec = self.memory.get(k)
+            if vec is not None:
+                found[k] = vec
+        hits = len(found)
+
+        missing = [k for k in first_index if k not in found]
+        disk_hits = 0
+        if missing and self.disk is not None:
+            for k, blob in self.disk.get_many(missing).items():
+                found[k] = np.frombuffer(blob, dtype=np.float32)
+                self.memory.put(k, found[k])
+                disk_hits += 1
+            missing = [k for k in missing if k not in found]
+
+        if missing:
+            # Duplicate texts in one batch are embedded once
+            vectors = embed_fn([texts[first_index[k]] for k in missing])
+            new: dict[str, bytes] = {}
+            for k, vec in zip(missing, vectors):
+                found[k] = np.asarray(vec, dtype=np.float32)
+                self.memory.put(k, found[k])
+                new[k] = found[k].tobytes()
+            if self.disk is not None:
+                self.disk.put_many(new)
+
+        with self._stats_lock:
+            self.stats["hits"] += hits
+            self.stats["disk_hits"] += disk_hits
+            self.stats["misses"] += len(missing)
+        return [found[k] for k in keys]
+
+
+class ResultCache:
+    """key -> str with a TTL, in an in-memory LRU and an optional SQLite tier.
+
+    The SQLite tier lets several worker processes share results; its entries
+    carry a wall-clock expiry so every process applies the same TTL.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 512,
+        ttl: float | None = 300,
+        db_path: str | Path | None = None,
+        namespace: str = "results",
+    ):
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+        self.disk = SQLiteStore(db_path, namespace) if db_path else None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.maxsize > 0 or self.disk is not None
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, str]:
+        found: dict[str, str] = {}
+        for k in keys:
+            value = self.memory.get(k)
+            if value is not None:
+                found[k] = value
+        hits = len(found)
+
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        disk_hits = 0
+        if missing and self.disk is not None:
+            now = time.time()
+            for k, blob in self.disk.get_many(missing).items():
+                entry = json.loads(blob)
+                if entry["expires"] is not None and entry["expires"] < now:
+                    continue
+                found[k] = entry["value"]
+                self.memory.put(k, entry["value"])
+                disk_hits += 1
+
+        with self._stats_lock:
+            self.stats["hits"] += hits
+            self.stats["disk_hits"] += disk_hits
+            self.stats["misses"] += len(missing) - disk_hits
+        return found
+
+    def put_many(self, items: dict[str, str]) -> None:
+        for k, value in items.items():
+            self.memory.put(k, value)
+        if self.disk is not None:
+            expires = time.time() + self.ttl if self.ttl else None
+            self.disk.put_many(
+                {k: json.dumps({"expires": expires, "value": v}, ensure_ascii=False).encode("utf-8") for k, v in items.items()}
+            )
@@ -8,10 +8,28 @@ Usage:
     # Then evaluate:
     uv run python phase-3/eval.py
 
+    # Compare the fixed-size and Markdown chunkers (in-memory, no re-ingest needed):
+    uv run python phase-3/eval.py --compare-chunkers
+
+    # Top-k with vs. without MMR; quantized vs. float vector search (recall@k):
+    uv run python phase-3/eval.py --compare-mmr
+    uv run python phase-3/eval.py --compare-quantization
+
+    # Latency + quality benchmark (per-stage p50/p95/p99, QPS, Recall@k, MRR) as JSON:
+    uv run python phase-3/eval.py --benchmark --repeat 5 --report phase-3/reports/markdown-auto.json
+
+    # Score against another labelled question set (e.g. the one synth.py writes):
+    uv run python phase-3/eval.py --benchmark --qa /tmp/synth/qa.jsonl
+
 What it does:
-    Runs 15 predefined questions against the RAG retriever and checks
-    whether the relevant source file appears in the results.
+    Runs 15 predefined questions (or a --qa JSONL set) against the RAG retriever (as one batch:
+    one embedding pass + one Chroma query) and checks whether the relevant
+    source file appears in the results.
     Outputs a hit-rate report and suggestions for improvement.
+    --benchmark runs each question on its own, times embedding, the vector
+    query alone, the whole search pipeline and formatting separately, and
+    scores the ranked sources (Recall@k, MRR);
+    --report writes everything as JSON so runs can be diffed.
 
 Learning goal:
     RAG is NOT "plug and play". You must measure and iterate.
@@ -20,11 +38,26 @@ Learning goal:
 
 from __future__ import annotations
 
-from retriever import search_notes
+import argparse
+import json
+import platform
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import chromadb
+import numpy as np
+
+import ingest
+import retriever
+from cache import normalize_query
+from vector_index import NumpyIndex
 
 # ---------------------------------------------------------------------------
 # 15 Q&A pairs: (question, expected_source_file)
 # A "hit" means the expected source appears in the retrieved results.
+# The expected source may also be a tuple of files when several are relevant
+# (any of them counts as a hit; Recall@k in --benchmark counts how many were retrieved).
 # ---------------------------------------------------------------------------
 QA_PAIRS = [
     # MCP
@@ -50,23 +83,46 @@ QA_PAIRS = [
 ]
 
 
-def evaluate(top_k: int = 3) -> None:
+def load_qa(path: str | Path) -> list[tuple[str, str | tuple[str, ...]]]:
+    """(question, expected_source) pairs from a JSONL file of {"question", "source", ...} records.
+
+    "source" is a file name or a list of them.
+    """
+    pairs = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if line.strip():
+            record = json.loads(line)
+            source = record["source"]
+            pairs.append((record["question"], source if isinstance(source, str) else tuple(source)))
+    return pairs
+
+
+def evaluate(
+    top_k: int = 3,
+    mode: str = retriever.SEARCH_MODE,
+    rerank: bool = retriever.RERANK,
+    min_score: float = retriever.MIN_SCORE,
+    expand: int = retriever.EXPAND_NEIGHBORS,
+    mmr: bool = retriever.MMR,
+) -> None:
     hits = 0
     misses = []
 
     print(f"{'='*60}")
-    print(f"RAG 评测  (top_k={top_k}, 共 {len(QA_PAIRS)} 题)")
+    print(f"RAG 评测  (top_k={top_k}, mode={mode}, rerank={rerank}, min_score={min_score}, expand={expand}, mmr={mmr}, 共 {len(QA_PAIRS)} 题)")
     print(f"{'='*60}\n")
 
-    for question, expected_source in QA_PAIRS:
-        result = search_notes(question, top_k=top_k)
-        hit = expected_source in result
+    all_hits = retriever._search(
+        [q for q, _ in QA_PAIRS], top_k, mode=mode, rerank=rerank, min_score=min_score, expand=expand, mmr=mmr
+    )
+    for (question, expected_source), result in zip(QA_PAIRS, all_hits):
+        hit = _is_hit(result, expected_source)
         status = "✅ HIT " if hit else "❌ MISS"
-        print(f"{status} | Q: {question[:40]:<40} | expected: {expected_source}")
+        print(f"{status} | Q: {question[:40]:<40} | expected: {_format_expected(expected_source)}")
         if hit:
             hits += 1
         else:
-            misses.append((question, expected_source, result[:200]))
+            misses.append((question, expected_source, retriever._format_hits(result)[:200]))
 
     hit_rate = hits / len(QA_PAIRS) * 100
     print(f"\n{'='*60}")
@@ -89,9 +145,305 @@ def evaluate(top_k: int = 3) -> None:
         print(f"\n--- 未命中的题目 ({len(misses)} 道) ---")
         for q, src, snippet in misses:
             print(f"\nQ: {q}")
-            print(f"Expected: {src}")
+            print(f"Expected: {_format_expected(src)}")
             print(f"Got: {snippet[:150]}...")
 
 
+# ---------------------------------------------------------------------------
+# Benchmark harness
+# ---------------------------------------------------------------------------
+def _percentile(samples: list[float], p: float) -> float:
+    """Linear-interpolated percentile (p in 0..100)."""
+    return float(np.percentile(samples, p)) if samples else 0.0
+
+
+def _latency_summary(samples: list[float]) -> dict[str, float]:
+    return {
+        "mean": float(np.mean(samples)) if samples else 0.0,
+        "p50": _percentile(samples, 50),
+        "p95": _percentile(samples, 95),
+        "p99": _percentile(samples, 99),
+        "max": max(samples, default=0.0),
+    }
+
+
+def _relevance(hits: list[dict], expected: str | tuple[str, ...]) -> tuple[int | None, float, float]:
+    """(rank of the first relevant hit or None, recall, reciprocal rank) for one ranked list.
+
+    Relevance is by source file, from hit metadata (not a substring of the formatted text).
+    """
+    relevant = {expected} if isinstance(expected, str) else set(expected)
+    sources = [h["metadata"].get("source") for h in hits]
+    rank = next((i + 1 for i, source in enumerate(sources) if source in relevant), None)
+    recall = len(relevant & set(sources)) / len(relevant)
+    return rank, recall, 1 / rank if rank else 0.0
+
+
+def _is_hit(hits: list[dict], expected: str | tuple[str, ...]) -> bool:
+    """Any relevant source among the hits (see _relevance)."""
+    return _relevance(hits, expected)[0] is not None
+
+
+def _format_expected(expected: str | tuple[str, ...]) -> str:
+    return expected if isinstance(expected, str) else " / ".join(expected)
+
+
+def benchmark(
+    top_k: int = 3,
+    repeat: int = 3,
+    report_path: str | Path | None = None,
+    mode: str = retriever.SEARCH_MODE,
+    rerank: bool = retriever.RERANK,
+    min_score: float = retriever.MIN_SCORE,
+    expand: int = retriever.EXPAND_NEIGHBORS,
+    mmr: bool = retriever.MMR,
+) -> dict:
+    """Time and score every QA question `repeat` times, one query at a time.
+
+    Per query: embed = one uncached model forward pass; vector = a plain top_k
+    query of the vector backend (Chroma or NumPy) on every shard, timed on its
+    own; pipeline = the full _search(): vector query (over-fetched for hybrid /
+    rerank / MMR), BM25 fusion, shard merge, rerank, MMR and expansion; format =
+    building the text the LLM sees. total = embed + pipeline + format, i.e. one
+    real request; the separate vector query is not part of it. The result cache
+    is bypassed. One warm-up pass runs first so model and collection loading
+    are not in the numbers.
+    Returns the report dict (also written to report_path as JSON).
+    """
+    options = dict(mode=mode, rerank=rerank, min_score=min_score, expand=expand, mmr=mmr)
+    questions = [q for q, _ in QA_PAIRS]
+    warm = retriever.warm_up()
+    retriever._search(questions, top_k, **options)
+
+    stages: dict[str, list[float]] = {
+        "embed_ms": [], "vector_ms": [], "pipeline_ms": [], "format_ms": [], "total_ms": []
+    }
+    per_query = []
+    for round_ in range(max(1, repeat)):
+        for question, expected in QA_PAIRS:
+            t0 = time.perf_counter()
+            vector = retriever._query_model([question])[0]
+            t1 = time.perf_counter()
+            retriever._fan_out(
+                lambda name: retriever._with_collection(lambda col: retriever._query(col, [vector], top_k), name=name),
+                retriever.SEARCH_COLLECTIONS,
+            )
+            t2 = time.perf_counter()
+            # Hand the fresh vector to the query cache so _search does not embed again
+            retriever._query_cache.get_many([normalize_query(question)], lambda texts: [vector])
+            hits = retriever._search([question], top_k, **options)[0]
+            t3 = time.perf_counter()
+            retriever._format_hits(hits)
+            t4 = time.perf_counter()
+            embed, pipeline, fmt = (t1 - t0) * 1000, (t3 - t2) * 1000, (t4 - t3) * 1000
+            timings = dict(zip(stages, (embed, (t2 - t1) * 1000, pipeline, fmt, embed + pipeline + fmt)))
+            for stage, ms in timings.items():
+                stages[stage].append(ms)
+            if round_ == 0:
+                rank, recall, rr = _relevance(hits, expected)
+                sources = [h["metadata"].get("source") for h in hits]
+                per_query.append(
+                    {"question": question, "expected": expected, "rank": rank, "recall": recall, "rr": rr,
+                     "sources": sources, **timings}
+                )
+
+    # Same questions as one batch: what eval / phase-4 fan-out actually pay
+    t0 = time.perf_counter()
+    retriever._query_model(questions)
+    batch_hits = retriever._search(questions, top_k, **options)
+    for hits in batch_hits:
+        retriever._format_hits(hits)
+    batch_elapsed = time.perf_counter() - t0
+
+    try:
+        import resource  # Unix only
+    except ImportError:
+        resource = None
+    n = len(per_query)
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "top_k": top_k,
+            "repeat": repeat,
+            **options,
+            "backend": retriever.SEARCH_BACKEND,
+            "quantization": retriever.VECTOR_QUANTIZATION,
+            "collections": {
+                name: {"version": retriever._read_version(name), "settings": ingest.load_manifest(name).get("settings")}
+                for name in retriever.SEARCH_COLLECTIONS
+            },
+            "python": platform.python_version(),
+        },
+        "warm_up_ms": warm["total_ms"],
+        # Peak resident memory of this process (ru_maxrss is KiB on Linux); None on Windows
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None,
+        "latency_ms": {stage.removesuffix("_ms"): _latency_summary(samples) for stage, samples in stages.items()},
+        # Back-to-back requests, without the separately timed vector queries
+        "qps": len(stages["total_ms"]) / (sum(stages["total_ms"]) / 1000),
+        "batch_qps": len(questions) / batch_elapsed,
+        "quality": {
+            f"hit_rate@{top_k}": sum(r["rank"] is not None for r in per_query) / n,
+            f"recall@{top_k}": sum(r["recall"] for r in per_query) / n,
+            f"mrr@{top_k}": sum(r["rr"] for r in per_query) / n,
+        },
+        "queries": per_query,
+    }
+
+    print(f"{'='*60}")
+    print(f"RAG 基准测试  (top_k={top_k}, {', '.join(f'{k}={v}' for k, v in options.items())}, "
+          f"{len(questions)} 题 x {repeat} 轮)")
+    print(f"{'='*60}\n")
+    print(f"{'stage':<8} | {'mean':>8} | {'p50':>8} | {'p95':>8} | {'p99':>8}   (ms)")
+    for stage, summary in report["latency_ms"].items():
+        print(f"{stage:<8} | {summary['mean']:>8.2f} | {summary['p50']:>8.2f} | {summary['p95']:>8.2f} | {summary['p99']:>8.2f}")
+    print(f"\nQPS: {report['qps']:.1f} (逐条)  /  {report['batch_qps']:.1f} (整批)   预热: {warm['total_ms']:.0f} ms")
+    print("  ".join(f"{name}: {value:.3f}" for name, value in report["quality"].items()))
+    if report_path:
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n报告已写入 {report_path}")
+    return report
+
+
+def _duplicate_chars(hits: list[dict]) -> int:
+    """Characters that several hits of one file share (overlapping start/end offsets)."""
+    spans: dict[str, list[tuple[int, int]]] = {}
+    for hit in hits:
+        meta = hit["metadata"]
+        if "start" in meta:
+            spans.setdefault(meta.get("source", ""), []).append((meta["start"], meta["end"]))
+    duplicate = 0
+    for intervals in spans.values():
+        covered, end = 0, -1
+        for start, stop in sorted(intervals):
+            covered += max(0, stop - max(start, end))
+            end = max(end, stop)
+        duplicate += sum(stop - start for start, stop in intervals) - covered
+    return duplicate
+
+
+def compare_mmr(top_k: int = 3, mode: str = retriever.SEARCH_MODE) -> None:
+    """Top-k with and without MMR on the QA set: hit rate, distinct files and
+    prompt characters (formatted results, and how many of them are repeated text)."""
+    questions = [q for q, _ in QA_PAIRS]
+    print(f"MMR 对比 (top_k={top_k}, mode={mode}, MMR_LAMBDA={retriever.MMR_LAMBDA}, 共 {len(QA_PAIRS)} 题)\n")
+    print(f"{'mmr':<5} | {'hit rate':>8} | {'files/q':>7} | {'prompt chars':>12} | {'repeated chars':>14}")
+    totals = {}
+    for mmr in (False, True):
+        all_hits = retriever._search(questions, top_k, mode=mode, mmr=mmr)
+        hits = sum(_is_hit(hits, expected) for hits, (_, expected) in zip(all_hits, QA_PAIRS))
+        files = sum(len({h["metadata"].get("source") for h in hits}) for hits in all_hits) / len(QA_PAIRS)
+        chars = sum(len(retriever._format_hits(hits)) for hits in all_hits)
+        repeated = sum(_duplicate_chars(hits) for hits in all_hits)
+        totals[mmr] = chars
+        print(f"{'on' if mmr else 'off':<5} | {hits:>3}/{len(QA_PAIRS):<4} | {files:>7.2f} | {chars:>12} | {repeated:>14}")
+    saved = totals[False] - totals[True]
+    print(f"\nMMR 节省 prompt 字符: {saved} ({saved / max(totals[False], 1) * 100:.1f}%)")
+    print("(repeated chars = 同一文件内重叠切片重复占用的字符；配合 --expand 合并后可直接省掉)")
+
+
+def compare_quantization(top_k: int = 3, rescore: int = retriever.QUANTIZED_RESCORE) -> None:
+    """Recall@k of int8 / binary first-pass search against exact float search.
+
+    Probes are the QA questions plus the first 200 characters of up to 200 chunks
+    per collection; the float top-k is the ground truth.
+    """
+    questions = [q for q, _ in QA_PAIRS]
+    print(f"量化检索对比 (top_k={top_k}, rescore={rescore}x)\n")
+    print(f"{'collection':<14} | {'vectors':<15} | {'resident MB':>11} | {'ms/query':>8} | recall@{top_k}")
+    for name in retriever.SEARCH_COLLECTIONS:
+        vectors_path = retriever.META_DIR / f"{name}.vectors.npy"
+        rows_path = retriever.META_DIR / f"{name}.rows.jsonl"
+        if not vectors_path.exists():
+            print(f"{name:<14} | (没有导出的向量，先运行 ingest.py)")
+            continue
+        space = (retriever._get_collection(name).configuration.get("hnsw") or {}).get("space", "l2")
+        exact = NumpyIndex.load(vectors_path, rows_path, space)
+        probes = questions + [doc[:200] for doc in exact.documents[:200]]
+        embeddings = np.asarray(retriever._embed_queries(probes), dtype=np.float32)
+
+        cases = [("float32", exact, exact.matrix.nbytes)]
+        for kind in ("int8", "binary"):
+            for r in (1, rescore):
+                index = NumpyIndex.load(vectors_path, rows_path, space, quantization=kind, rescore=r)
+                cases.append((f"{kind} x{r}", index, index.quantized.nbytes))
+
+        truth = None
+        for label, index, nbytes in cases:
+            started = time.perf_counter()
+            ids = index.query(embeddings, n_results=top_k, include=["distances"])["ids"]
+            ms = (time.perf_counter() - started) * 1000 / len(probes)
+            truth = truth or ids
+            recall = np.mean([len(set(t) & set(g)) / max(len(t), 1) for t, g in zip(truth, ids)])
+            print(f"{name:<14} | {label:<15} | {nbytes / 1e6:>11.3f} | {ms:>8.3f} | {recall:.3f}")
+    print("\n(xN = 用量化码先选出 N*top_k 个候选，再用 float 向量精排；resident MB 不含内存映射的 float 矩阵)")
+
+
+def compare_chunkers(top_k: int = 3) -> None:
+    """Chunk notes/ with each chunker into a throwaway in-memory collection and
+    report chunk count, stored characters and hit rate side by side."""
+    md_files = sorted(ingest.NOTES_DIR.glob("*.md"))
+    questions = [q for q, _ in QA_PAIRS]
+    client = chromadb.EphemeralClient()
+
+    print(f"{'chunker':<10} | {'chunks':>6} | {'chars':>7} | {'max tokens':>10} | hit rate (top_k={top_k})")
+    for chunker in ("fixed", "markdown"):
+        records = [
+            record
+            for md_file in md_files
+            for record in ingest.iter_file_chunks(md_file, md_file.read_text(encoding="utf-8"), chunker)
+        ]
+        ids = [r[0] for r in records]
+        docs = [r[1] for r in records]
+        collection = client.create_collection(
+            f"eval-{chunker}", configuration={"hnsw": {"space": ingest.DISTANCE_SPACE}}, embedding_function=None
+        )
+        collection.add(ids=ids, documents=docs, metadatas=[r[2] for r in records], embeddings=ingest._model(docs))
+
+        all_hits = retriever._search(questions, top_k, collection=collection)
+        hits = sum(_is_hit(hits, expected) for hits, (_, expected) in zip(all_hits, QA_PAIRS))
+        max_tokens = max(ingest.estimate_tokens(d) for d in docs)
+        print(
+            f"{chunker:<10} | {len(docs):>6} | {sum(map(len, docs)):>7} | {max_tokens:>10} | "
+            f"{hits}/{len(QA_PAIRS)} = {hits / len(QA_PAIRS) * 100:.1f}%"
+        )
+        client.delete_collection(collection.name)
+    print("\n(max tokens 是估算值；MiniLM 只看前 256 个 token，超出部分不会进入向量)")
+
+
 if __name__ == "__main__":
-    evaluate(top_k=3)
+    parser = argparse.ArgumentParser(description="RAG retrieval evaluation")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--mode", choices=["hybrid", "vector"], default=retriever.SEARCH_MODE)
+    parser.add_argument("--rerank", action="store_true", default=retriever.RERANK, help="enable the rerank stage")
+    parser.add_argument(
+        "--min-score", type=float, default=retriever.MIN_SCORE, help="drop passages below this similarity"
+    )
+    parser.add_argument(
+        "--expand", type=int, default=retriever.EXPAND_NEIGHBORS, help="neighbouring chunks merged into each hit"
+    )
+    parser.add_argument("--mmr", action="store_true", default=retriever.MMR, help="diversity-aware top_k (MMR)")
+    parser.add_argument("--compare-mmr", action="store_true", help="top_k with vs. without MMR")
+    parser.add_argument("--compare-quantization", action="store_true", help="int8 / binary vs. float recall@k")
+    parser.add_argument("--benchmark", action="store_true", help="latency percentiles, QPS, Recall@k and MRR")
+    parser.add_argument("--repeat", type=int, default=3, help="rounds over the QA set in --benchmark")
+    parser.add_argument("--report", help="write the --benchmark report to this JSON file")
+    parser.add_argument("--qa", help="JSONL question set to use instead of the built-in QA_PAIRS")
+    parser.add_argument("--compare-chunkers", action="store_true", help="fixed vs markdown chunker report")
+    args = parser.parse_args()
+    if args.qa:
+        QA_PAIRS[:] = load_qa(args.qa)
+    if args.compare_chunkers:
+        compare_chunkers(top_k=args.top_k)
+    elif args.compare_mmr:
+        compare_mmr(top_k=args.top_k, mode=args.mode)
+    elif args.compare_quantization:
+        compare_quantization(top_k=args.top_k)
+    elif args.benchmark:
+        benchmark(
+            top_k=args.top_k, repeat=args.repeat, report_path=args.report, mode=args.mode, rerank=args.rerank,
+            min_score=args.min_score, expand=args.expand, mmr=args.mmr,
+        )
+    else:
+        evaluate(top_k=args.top_k, mode=args.mode, rerank=args.rerank, min_score=args.min_score, expand=args.expand, mmr=args.mmr)
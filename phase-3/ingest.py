@@ -2,14 +2,44 @@
 Phase 3 - Step 1: Ingest notes into ChromaDB
 
 Usage:
-    uv run python phase-3/ingest.py
+    uv run python phase-3/ingest.py          # incremental: only re-embed what changed
+    uv run python phase-3/ingest.py --full   # drop and rebuild the whole collection
+    uv run python phase-3/ingest.py --workers 8   # embed with 8 processes
+    uv run python phase-3/ingest.py --corpus notes   # only one corpus
 
 What it does:
-    1. Read all .md files from phase-3/notes/
-    2. Chunk text (fixed-size with overlap)
+    Every corpus in CORPORA (phase-3/notes -> "notes", phase-4/notes ->
+    "phase4_notes") gets its own collection; the retriever searches them as
+    shards. For each corpus:
+    1. Read all .md files from its notes directory
+    2. Chunk text: Markdown structure-aware by default (CHUNKER=markdown),
+       or the original fixed-size windows with overlap (CHUNKER=fixed).
+       Each chunk gets topic tags (TOPIC_TAGS keyword rules) stored as
+       tag_<name>=True metadata, so searches can filter on them.
     3. Embed each chunk using ChromaDB's default local embedding function
        (sentence-transformers/all-MiniLM-L6-v2, runs locally, no API needed)
     4. Store into ChromaDB at ./phase-3/chroma_db/
+    Steps 1-4 are a streaming generator pipeline: chunks are embedded and
+    written in batches of INGEST_BATCH_SIZE (or --batch-size), so memory stays
+    flat no matter how big the corpus is, and throughput is printed per batch.
+    With --workers N, batches are embedded by N processes while this process
+    stays the only writer to ChromaDB.
+    5. Rebuild the BM25 keyword index (chroma_meta/<collection>.bm25.json)
+       from what is now stored in the collection, and export the vectors
+       (<collection>.vectors.npy + .rows.jsonl, with int8 / binary quantized
+       copies) for the NumPy search backend
+    6. Bump the version stamp in ./phase-3/chroma_meta/ so running retrievers
+       reopen the rebuilt collection and reload the BM25 index
+
+Incremental mode:
+    A manifest (chroma_meta/<collection>.manifest.json) remembers the sha256
+    of every file and of every chunk's text and metadata. Unchanged files are
+    skipped, chunks of removed files are deleted, and only chunks whose text
+    is new get embedded — chunks that merely moved reuse their stored
+    embedding. Chunks whose text is unchanged but whose metadata changed
+    (offsets, headings, tags) only get their metadata rewritten.
+    Changing CHUNKER / CHUNK_TOKENS / CHUNK_SIZE / CHUNK_OVERLAP / DISTANCE_SPACE
+    or TOPIC_TAGS forces a full rebuild.
 
 Why local embedding?
     The remote proxy API blocks Chinese text (returns HTML error page).
@@ -19,85 +49,796 @@ Why local embedding?
 
 from __future__ import annotations
 
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
 import os
+import re
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
 
 import chromadb
+import numpy as np
 from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
 from dotenv import load_dotenv
 
+from bm25 import BM25Index
+from vector_index import export_collection
+
 load_dotenv()
 
 # --- Config ---
 NOTES_DIR = Path(__file__).parent / "notes"
 CHROMA_DIR = Path(__file__).parent / "chroma_db"
 COLLECTION_NAME = "notes"
+# Collection name -> notes directory; one collection (shard) per corpus.
+# INGEST_CORPORA="notes=phase-3/notes,other=/path/to/md" overrides it.
+CORPORA = {
+    COLLECTION_NAME: NOTES_DIR,
+    "phase4_notes": Path(__file__).parent.parent / "phase-4" / "notes",
+}
+if os.getenv("INGEST_CORPORA"):
+    CORPORA = {
+        name.strip(): Path(path.strip())
+        for name, path in (item.split("=", 1) for item in os.environ["INGEST_CORPORA"].split(","))
+    }
+# Side files (version stamps, ...) live next to chroma_db, see retriever.py
+META_DIR = Path(__file__).parent / "chroma_meta"
 
+# "markdown": heading/paragraph-aware chunks packed up to CHUNK_TOKENS
+# "fixed":    the original fixed-size character windows (CHUNK_SIZE / CHUNK_OVERLAP)
+CHUNKER = os.getenv("CHUNKER", "markdown")
+# MiniLM truncates input at 256 tokens; stay a bit below since this is an estimate
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "240"))
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+# Bump when the stored metadata layout or the chunk boundaries change
+# (2: start/end offsets, 3: topic tags, 4: oversized blocks cut on token boundaries)
+INDEX_FORMAT = 4
+# HNSW distance space of the collection: "cosine" (1 - cos), "ip" (1 - dot) or
+# "l2" (squared L2). The retriever turns the distance back into a similarity.
+DISTANCE_SPACE = os.getenv("DISTANCE_SPACE", "cosine")
+
+# Topic tag -> keywords. A chunk gets the tag when its file name, heading path
+# or text mentions one of them (latin keywords match whole words only).
+# Must match TOPIC_TAGS in retriever.py (the tool schema lists the names).
+TOPIC_TAGS = {
+    "mcp": ["mcp", "model context protocol"],
+    "function_calling": ["function calling", "function-calling", "tool_calls", "tool schema", "函数调用"],
+    "langgraph": ["langgraph", "stategraph", "checkpointer"],
+    "embedding": ["embedding", "embeddings", "chunking", "向量", "余弦相似度"],
+    "rag": ["rag", "retrieval", "chromadb", "检索", "知识库"],
+    "agent_patterns": ["react", "plan-and-execute", "supervisor", "multi-agent", "设计模式"],
+}
+
+# Chunks embedded + written per flush; memory use is bounded by this, not corpus size
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+# Embedding processes; the single writer (this process) stores precomputed vectors
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
 
 # Local embedding function (downloads model on first run, ~90MB)
 _embed_fn = DefaultEmbeddingFunction()
+# Same model, one long-lived instance: we embed chunks ourselves so that
+# unchanged chunks can skip the model (DefaultEmbeddingFunction reloads it per call)
+_model = ONNXMiniLM_L6_V2()
+
+
+def iter_chunk_spans(
+    text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP
+) -> Iterator[tuple[int, int]]:
+    """Yield (start, end) of overlapping fixed-size windows, whitespace-trimmed.
+
+    Nothing is sliced or copied: text[start:end] is the chunk, and the offsets
+    let the retriever merge neighbouring chunks without re-reading the file.
+    """
+    if chunk_size <= 0 or not 0 <= overlap < chunk_size:
+        # overlap >= chunk_size would never advance (or walk backwards)
+        raise ValueError(f"Need 0 <= overlap < chunk_size, got chunk_size={chunk_size}, overlap={overlap}")
+    n = len(text)
+    for window_start in range(0, n, chunk_size - overlap):
+        start, end = window_start, min(window_start + chunk_size, n)
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            yield start, end
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """Lazily split text into overlapping fixed-size chunks."""
+    return (text[start:end] for start, end in iter_chunk_spans(text, chunk_size, overlap))
+
+
+# ---------------------------------------------------------------------------
+# Structure-aware Markdown chunker
+# ---------------------------------------------------------------------------
+# Roughly one MiniLM token per CJK character, word, or punctuation mark
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+# Where an oversized block may be cut: after a sentence end, or at a line break
+_BREAK_RE = re.compile(r"(?<=[。！？；.!?;])\s*|\n\s*")
+# A heading at this level or above starts a new chunk once the current
+# chunk is at least half full; smaller sections are packed into their neighbours
+SECTION_LEVEL = 2
+
+
+def estimate_tokens(text: str, start: int = 0, end: int | None = None) -> int:
+    """Approximate token count of text[start:end], without slicing the text."""
+    end = len(text) if end is None else end
+    return len(_TOKEN_RE.findall(text, start, end))
+
+
+def _iter_lines(text: str) -> Iterator[tuple[int, int]]:
+    """Yield (start, end) of each line, end excluding the newline."""
+    start, n = 0, len(text)
+    while start < n:
+        nl = text.find("\n", start)
+        if nl == -1:
+            yield start, n
+            return
+        yield start, nl
+        start = nl + 1
+
+
+def _markdown_blocks(text: str) -> Iterator[tuple[int, int, int]]:
+    """Yield (start, end, heading_level) for headings, fenced code blocks and paragraphs.
+
+    heading_level is 0 for non-heading blocks. Spans exclude the trailing newline.
+    """
+    block_start = last_end = None
+    fence: str | None = None
+    for line_start, line_end in _iter_lines(text):
+        if line_end > line_start and text[line_end - 1] == "\r":
+            line_end -= 1
+        stripped = text[line_start:line_end].strip()
+
+        if fence is not None:
+            if stripped.startswith(fence):
+                fence = None
+                yield block_start, line_end, 0
+                block_start = None
+            continue
+
+        if stripped.startswith("```") or stripped.startswith("~~~"):
+            if block_start is not None:
+                yield block_start, last_end, 0
+            block_start, fence = line_start, stripped[:3]
+            continue
+
+        heading = _HEADING_RE.match(stripped) if stripped.startswith("#") else None
+        if heading or not stripped:
+            if block_start is not None:
+                yield block_start, last_end, 0
+                block_start = None
+            if heading:
+                yield line_start, line_end, len(heading.group(1))
+            continue
+
+        if block_start is None:
+            block_start = line_start
+        last_end = line_end
+
+    if block_start is not None:
+        # Unclosed fence or trailing paragraph
+        yield block_start, len(text.rstrip()) if fence else last_end, 0
+
+
+def _split_oversized(text: str, start: int, end: int, max_tokens: int) -> Iterator[tuple[int, int]]:
+    """Split one block that is over budget: pack sentences / lines, window what still does not fit."""
+    piece_start = prev = start
+    tokens = 0
+    cuts = [match.end() for match in _BREAK_RE.finditer(text, start, end)]
+    for cut in cuts + [end]:
+        if cut <= prev:
+            continue
+        unit_tokens = estimate_tokens(text, prev, cut)
+        if unit_tokens > max_tokens:
+            # No usable break inside (long sentence, code line, URL, ...): token windows.
+            # A piece less than half full (e.g. the heading) rides along in the first one.
+            if tokens >= max_tokens // 2:
+                yield piece_start, _trim_end(text, piece_start, prev)
+                piece_start = prev
+            windows = list(_token_windows(text, piece_start, cut, max_tokens))
+            yield from windows[:-1]
+            # The last window stays open for the sentences that follow
+            piece_start = windows[-1][0]
+            tokens = estimate_tokens(text, piece_start, cut)
+        elif tokens and tokens + unit_tokens > max_tokens:
+            yield piece_start, _trim_end(text, piece_start, prev)
+            piece_start, tokens = prev, unit_tokens
+        else:
+            tokens += unit_tokens
+        prev = cut
+    if tokens:
+        yield piece_start, end
+
+
+def _trim_end(text: str, start: int, end: int) -> int:
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
+
+
+def _token_windows(text: str, start: int, end: int, max_tokens: int) -> Iterator[tuple[int, int]]:
+    """Cut text[start:end] into pieces of max_tokens tokens, never inside a token."""
+    piece_start = last_end = None
+    count = 0
+    for match in _TOKEN_RE.finditer(text, start, end):
+        if count == max_tokens:
+            yield piece_start, last_end
+            piece_start, count = None, 0
+        if piece_start is None:
+            piece_start = match.start()
+        count += 1
+        last_end = match.end()
+    if piece_start is not None:
+        yield piece_start, last_end
+
+
+def iter_markdown_chunks(text: str, max_tokens: int = CHUNK_TOKENS) -> Iterator[tuple[int, int, str]]:
+    """Yield (start, end, heading_path) for Markdown chunks of at most ~max_tokens.
+
+    - A "#"/"##" heading starts a new chunk unless the current one is less
+      than half full; sections are otherwise packed while they fit the budget.
+    - A heading is never left dangling at the end of a chunk: it is glued to
+      the block that follows it.
+    - Paragraphs and fenced code blocks are only split when a single block is
+      over budget.
+    text[start:end] is the chunk; there is no overlap between chunks.
+    """
+    path: list[tuple[int, str]] = []
+    chunk_start = chunk_end = None
+    chunk_tokens = 0
+    chunk_path = ""
+    pending_heading = None  # start offset of heading(s) waiting for content
+
+    for start, end, level in _markdown_blocks(text):
+        if level:
+            if level <= SECTION_LEVEL and chunk_start is not None and chunk_tokens >= max_tokens // 2:
+                yield chunk_start, chunk_end, chunk_path
+                chunk_start = None
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, _HEADING_RE.match(text[start:end].strip()).group(2)))
+            if pending_heading is None:
+                pending_heading = start
+            continue
+
+        unit_start = pending_heading if pending_heading is not None else start
+        pending_heading = None
+        unit_tokens = estimate_tokens(text, unit_start, end)
+        heading_path = " > ".join(title for _, title in path)
+
+        if chunk_start is not None and chunk_tokens + unit_tokens > max_tokens:
+            yield chunk_start, chunk_end, chunk_path
+            chunk_start = None
+
+        if unit_tokens > max_tokens:
+            for piece_start, piece_end in _split_oversized(text, unit_start, end, max_tokens):
+                yield piece_start, piece_end, heading_path
+            continue
+
+        if chunk_start is None:
+            chunk_start, chunk_tokens, chunk_path = unit_start, 0, heading_path
+        chunk_end = end
+        chunk_tokens += unit_tokens
+
+    if pending_heading is not None:
+        # Trailing heading without content
+        if chunk_start is None:
+            chunk_start, chunk_path = pending_heading, " > ".join(title for _, title in path)
+        chunk_end = len(text.rstrip())
+    if chunk_start is not None:
+        yield chunk_start, chunk_end, chunk_path
+
+
+def chunk_markdown(text: str, max_tokens: int = CHUNK_TOKENS) -> list[str]:
+    """Split Markdown into heading/paragraph-aware chunks (see iter_markdown_chunks)."""
+    return [text[start:end] for start, end, _ in iter_markdown_chunks(text, max_tokens)]
+
+
+def _keyword_re(keywords: list[str]) -> re.Pattern:
+    parts = [rf"(?<![\w-]){re.escape(k)}(?![\w-])" if k.isascii() else re.escape(k) for k in keywords]
+    return re.compile("|".join(parts), re.IGNORECASE)
+
+
+_TAG_RES = {tag: _keyword_re(keywords) for tag, keywords in TOPIC_TAGS.items()}
+
+
+def topic_tags(*texts: str) -> list[str]:
+    """Names of the TOPIC_TAGS whose keywords appear in any of the texts."""
+    return [tag for tag, pattern in _TAG_RES.items() if any(pattern.search(t) for t in texts)]
+
+
+def iter_file_chunks(
+    md_file: Path,
+    text: str,
+    chunker: str = CHUNKER,
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+) -> Iterator[tuple[str, str, dict]]:
+    """Yield (chunk_id, document, metadata) for one file with the configured chunker.
+
+    chunk_size / overlap only apply to the fixed chunker (sweep.py varies them).
+    metadata carries the chunk's character offsets in the file as start / end,
+    and tag_<name>=True for every topic tag (Chroma metadata values must be scalars).
+    """
+    if chunker == "markdown":
+        spans = iter_markdown_chunks(text)
+    elif chunker == "fixed":
+        spans = ((start, end, None) for start, end in iter_chunk_spans(text, chunk_size, overlap))
+    else:
+        raise ValueError(f"Unknown CHUNKER: {chunker!r} (expected 'markdown' or 'fixed')")
+
+    for i, (start, end, headings) in enumerate(spans):
+        metadata = {"source": md_file.name, "chunk_index": i, "start": start, "end": end}
+        if headings is not None:
+            metadata["headings"] = headings
+        for tag in topic_tags(md_file.stem, headings or "", text[start:end]):
+            metadata[f"tag_{tag}"] = True
+        yield f"{md_file.stem}_chunk_{i}", text[start:end], metadata
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _metadata_hash(metadata: dict) -> str:
+    return _sha256(json.dumps(metadata, sort_keys=True, ensure_ascii=False))
+
+
+def _stored_metadata(metadata: dict) -> dict:
+    """metadata with None for every optional key it lacks.
+
+    Chroma merges metadata on upsert / update: a key left out keeps its old
+    value, so a chunk that lost a tag or its headings would keep them. None
+    deletes the key (and is simply dropped on a new record).
+    """
+    return {"headings": None, **{f"tag_{tag}": None for tag in TOPIC_TAGS}, **metadata}
+
+
+def _manifest_path(collection_name: str = COLLECTION_NAME) -> Path:
+    return META_DIR / f"{collection_name}.manifest.json"
+
+
+def _settings() -> dict:
+    """Everything that changes chunks, their metadata or the index; a mismatch forces --full."""
+    settings = {"format": INDEX_FORMAT, "space": DISTANCE_SPACE, "topic_tags": TOPIC_TAGS, "chunker": CHUNKER}
+    if CHUNKER == "markdown":
+        return {**settings, "chunk_tokens": CHUNK_TOKENS}
+    return {**settings, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
 
 
-def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
-    """Split text into overlapping fixed-size chunks."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
+def load_manifest(collection_name: str = COLLECTION_NAME) -> dict:
+    path = _manifest_path(collection_name)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
 
 
-def ingest():
+def save_manifest(manifest: dict, collection_name: str = COLLECTION_NAME) -> None:
+    META_DIR.mkdir(parents=True, exist_ok=True)
+    path = _manifest_path(collection_name)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(path)
+
+
+def write_version(collection_name: str = COLLECTION_NAME) -> str:
+    """Stamp the collection with a fresh version so retrievers drop stale handles."""
+    META_DIR.mkdir(parents=True, exist_ok=True)
+    version = uuid.uuid4().hex
+    path = META_DIR / f"{collection_name}.version"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(version, encoding="utf-8")
+    tmp.replace(path)  # atomic: readers never see a half-written stamp
+    return version
+
+
+def ingest(
+    full: bool = False,
+    batch_size: int = INGEST_BATCH_SIZE,
+    workers: int = INGEST_WORKERS,
+    collection_name: str = COLLECTION_NAME,
+    notes_dir: Path = NOTES_DIR,
+):
+    """Ingest one corpus (notes_dir) into one collection; see ingest_all() for every corpus."""
     chroma = chromadb.PersistentClient(path=str(CHROMA_DIR))
+    batch_size = max(1, min(batch_size, chroma.get_max_batch_size()))
 
-    # Drop and recreate collection for a clean ingest
-    try:
-        chroma.delete_collection(COLLECTION_NAME)
-        print(f"[ingest] Deleted existing collection '{COLLECTION_NAME}'")
-    except Exception:
-        pass
-    # Use local embedding function for the collection
-    collection = chroma.create_collection(
-        COLLECTION_NAME,
+    manifest = {} if full else load_manifest(collection_name)
+    if not full and manifest.get("settings") != _settings():
+        if manifest:
+            print("[ingest] Chunk / index settings changed since last run, doing a full rebuild")
+        else:
+            print("[ingest] No manifest found, doing a full rebuild")
+        full = True
+
+    if full:
+        # Drop and recreate collection for a clean ingest
+        try:
+            chroma.delete_collection(collection_name)
+            print(f"[ingest] Deleted existing collection '{collection_name}'")
+        except Exception:
+            pass
+        manifest = {}
+    # Use local embedding function for the collection; the space is fixed at creation
+    collection = chroma.get_or_create_collection(
+        collection_name,
+        configuration={"hnsw": {"space": DISTANCE_SPACE}},
         embedding_function=_embed_fn,
     )
+    if manifest.get("files") and collection.count() == 0:
+        print("[ingest] Collection is empty but the manifest is not, re-embedding everything")
+        manifest = {}
 
-    md_files = sorted(NOTES_DIR.glob("*.md"))
+    md_files = sorted(Path(notes_dir).glob("*.md"))
     if not md_files:
-        print(f"[ingest] No .md files found in {NOTES_DIR}")
-        return
+        print(f"[ingest] No .md files found in {notes_dir}")
 
-    all_ids: list[str] = []
-    all_docs: list[str] = []
-    all_metadatas: list[dict] = []
+    old_files: dict = manifest.get("files", {})
+    new_files: dict = {}
+    stale_ids: set[str] = set()
+    meta_updates: list[tuple[str, dict]] = []
+    counts = {"unchanged": 0}
 
-    for md_file in md_files:
-        text = md_file.read_text(encoding="utf-8")
-        chunks = chunk_text(text)
-        print(f"[ingest] {md_file.name}: {len(chunks)} chunks")
-
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{md_file.stem}_chunk_{i}"
-            all_ids.append(chunk_id)
-            all_docs.append(chunk)
-            all_metadatas.append({"source": md_file.name, "chunk_index": i})
-
-    print("[ingest] Embedding and storing (local model, first run may take 10-30s)...")
-    # ChromaDB auto-embeds when embedding_function is set on the collection
-    collection.add(
-        ids=all_ids,
-        documents=all_docs,
-        metadatas=all_metadatas,
+    # Stored embeddings that moved chunks can reuse, located before anything is overwritten
+    reuse_ids, snapshot = _plan_reuse(collection, _iter_files(md_files), old_files, batch_size)
+
+    # read → chunk → embed → add, one batch in memory at a time
+    records = _iter_changed_chunks(_iter_files(md_files), old_files, new_files, stale_ids, meta_updates, counts)
+    batches = _embed_batches(collection, _batched(records, batch_size), reuse_ids, snapshot, workers)
+
+    upserted = 0
+    started = time.perf_counter()
+    for batch, embeddings in batches:
+        collection.upsert(
+            ids=[r["id"] for r in batch],
+            documents=[r["document"] for r in batch],
+            metadatas=[_stored_metadata(r["metadata"]) for r in batch],
+            embeddings=embeddings,
+        )
+        upserted += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f"[ingest] Stored {upserted} chunks ({upserted / elapsed:.1f} chunks/s)")
+
+    # Same text, new offsets / headings / tags: no re-embedding needed
+    for k in range(0, len(meta_updates), batch_size):
+        page = meta_updates[k : k + batch_size]
+        collection.update(ids=[cid for cid, _ in page], metadatas=[_stored_metadata(m) for _, m in page])
+    updated = len(meta_updates)
+
+    for name, old in old_files.items():
+        if name not in new_files:
+            stale_ids.update(old["chunks"])
+            print(f"[ingest] {name}: removed")
+    stale = sorted(stale_ids)
+    for k in range(0, len(stale), batch_size):
+        collection.delete(ids=stale[k : k + batch_size])
+
+    save_manifest({"settings": _settings(), "files": new_files}, collection_name)
+    bm25_path = META_DIR / f"{collection_name}.bm25.json"
+    vectors_path = META_DIR / f"{collection_name}.vectors.npy"
+    if full or upserted or updated or stale or not bm25_path.exists():
+        bm25 = build_bm25(collection)
+        bm25.save(bm25_path)
+        print(f"[ingest] BM25 index: {len(bm25)} chunks, {len(bm25.postings)} terms")
+    if full or upserted or updated or stale or not vectors_path.exists():
+        rows = export_collection(collection, vectors_path, META_DIR / f"{collection_name}.rows.jsonl")
+        print(f"[ingest] Exported {rows} vectors to {vectors_path.name}")
+    if full or upserted or updated or stale:
+        write_version(collection_name)
+    print(
+        f"\n[ingest] Done! {upserted} chunks upserted, {updated} metadata-only updates, {len(stale)} deleted, "
+        f"{counts['unchanged']} unchanged in '{collection_name}' (total {collection.count()})"
     )
-    print(f"\n[ingest] Done! Stored {len(all_ids)} chunks into '{COLLECTION_NAME}'")
     print(f"[ingest] ChromaDB path: {CHROMA_DIR.resolve()}")
 
 
+def ingest_all(
+    full: bool = False,
+    batch_size: int = INGEST_BATCH_SIZE,
+    workers: int = INGEST_WORKERS,
+    corpora: list[str] | None = None,
+):
+    """Ingest every corpus in CORPORA (or just the named ones), one collection each."""
+    for name in corpora or list(CORPORA):
+        print(f"[ingest] === {name}: {CORPORA[name]} ===")
+        ingest(full=full, batch_size=batch_size, workers=workers, collection_name=name, notes_dir=CORPORA[name])
+
+
+def build_bm25(collection: chromadb.Collection, page_size: int = 1000) -> BM25Index:
+    """Build the keyword index from the collection itself (covers unchanged chunks too)."""
+
+    def pages():
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents"])
+            if not page["ids"]:
+                return
+            yield from zip(page["ids"], page["documents"])
+            offset += len(page["ids"])
+
+    return BM25Index.from_documents(pages())
+
+
+# ---------------------------------------------------------------------------
+# Pipeline stages (generators: nothing is held for the whole corpus)
+# ---------------------------------------------------------------------------
+def _iter_files(md_files: Iterable[Path]) -> Iterator[tuple[Path, str]]:
+    for md_file in md_files:
+        yield md_file, md_file.read_text(encoding="utf-8")
+
+
+def _iter_changed_chunks(
+    files: Iterable[tuple[Path, str]],
+    old_files: dict,
+    new_files: dict,
+    stale_ids: set[str],
+    meta_updates: list[tuple[str, dict]],
+    counts: dict,
+) -> Iterator[dict]:
+    """Yield chunk records that need (re-)embedding.
+
+    Fills new_files / stale_ids, and meta_updates with (chunk id, metadata)
+    for chunks whose text is unchanged but whose metadata is not, as a side effect.
+    """
+    for md_file, text in files:
+        file_hash = _sha256(text)
+        old = old_files.get(md_file.name)
+        if old and old["sha256"] == file_hash:
+            new_files[md_file.name] = old
+            counts["unchanged"] += len(old["chunks"])
+            print(f"[ingest] {md_file.name}: unchanged")
+            continue
+
+        old_chunks = old["chunks"] if old else {}
+        # Manifests written before metadata hashes existed: treat metadata as changed
+        old_meta = old.get("meta", {}) if old else {}
+        entry = {"sha256": file_hash, "chunks": {}, "meta": {}}
+        changed = 0
+        for chunk_id, chunk, metadata in iter_file_chunks(md_file, text):
+            chunk_hash = _sha256(chunk)
+            meta_hash = _metadata_hash(metadata)
+            entry["chunks"][chunk_id] = chunk_hash
+            entry["meta"][chunk_id] = meta_hash
+            if old_chunks.get(chunk_id) == chunk_hash:
+                if old_meta.get(chunk_id) != meta_hash:
+                    meta_updates.append((chunk_id, metadata))
+                counts["unchanged"] += 1
+                continue
+            changed += 1
+            yield {
+                "id": chunk_id,
+                "document": chunk,
+                "metadata": metadata,
+                "hash": chunk_hash,
+            }
+        stale_ids.update(cid for cid in old_chunks if cid not in entry["chunks"])
+        new_files[md_file.name] = entry
+        print(f"[ingest] {md_file.name}: {len(entry['chunks'])} chunks ({changed} changed)")
+
+
+def _batched(records: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    batch: list[dict] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _plan_reuse(
+    collection: chromadb.Collection,
+    files: Iterable[tuple[Path, str]],
+    old_files: dict,
+    page_size: int,
+) -> tuple[dict[str, str], dict[str, object]]:
+    """Find stored embeddings that chunks about to be written can reuse.
+
+    Returns (chunk hash -> id of a stored chunk with that text that this run
+    does not overwrite, chunk hash -> embedding). The second dict snapshots
+    the texts whose only stored copy sits under an id that gets new text in
+    this run: once an earlier batch has upserted that id, reading it back
+    would return the new chunk's vector. Only changed files are chunked here
+    (a second time, but chunking is cheap next to embedding); the snapshot
+    holds one vector per moved chunk, not the corpus.
+    """
+    if not old_files:
+        return {}, {}
+    # chunk hash -> every stored chunk id holding that text
+    old_ids_by_hash: dict[str, list[str]] = {}
+    for entry in old_files.values():
+        for cid, h in entry["chunks"].items():
+            old_ids_by_hash.setdefault(h, []).append(cid)
+
+    written: set[str] = set()
+    wanted: set[str] = set()
+    for md_file, text in files:
+        old = old_files.get(md_file.name)
+        if old and old["sha256"] == _sha256(text):
+            continue
+        old_chunks = old["chunks"] if old else {}
+        for chunk_id, chunk, _ in iter_file_chunks(md_file, text):
+            chunk_hash = _sha256(chunk)
+            if old_chunks.get(chunk_id) != chunk_hash:
+                written.add(chunk_id)
+                if chunk_hash in old_ids_by_hash:
+                    wanted.add(chunk_hash)
+
+    reuse_ids: dict[str, str] = {}
+    overwritten: dict[str, str] = {}
+    for h in wanted:
+        safe = [cid for cid in old_ids_by_hash[h] if cid not in written]
+        if safe:
+            reuse_ids[h] = safe[0]
+        else:
+            overwritten[h] = old_ids_by_hash[h][0]
+
+    snapshot: dict[str, object] = {}
+    items = list(overwritten.items())
+    for k in range(0, len(items), page_size):
+        page = dict(items[k : k + page_size])
+        got = collection.get(ids=list(page.values()), include=["embeddings"])
+        by_id = dict(zip(got["ids"], got["embeddings"]))
+        snapshot.update((h, by_id[cid]) for h, cid in page.items() if cid in by_id)
+    return reuse_ids, snapshot
+
+
+def _embed_batches(
+    collection: chromadb.Collection,
+    batches: Iterable[list[dict]],
+    reuse_ids: dict[str, str],
+    snapshot: dict[str, object],
+    workers: int = 1,
+) -> Iterator[tuple[list[dict], list]]:
+    """Attach embeddings to each batch, reusing stored ones for chunk texts seen before.
+
+    reuse_ids / snapshot come from _plan_reuse(); ids in reuse_ids are never
+    written in this run, so reading them lazily per batch is safe even while
+    earlier batches are being upserted.
+    With workers > 1 the model runs in a process pool; batches still come out
+    in order, and at most 2 * workers batches are in flight at once.
+    """
+
+    def prepared() -> Iterator[tuple[list[dict], dict, list[int]]]:
+        for batch in batches:
+            stored = {r["hash"]: snapshot[r["hash"]] for r in batch if r["hash"] in snapshot}
+            lookup = {r["hash"]: reuse_ids[r["hash"]] for r in batch if r["hash"] in reuse_ids}
+            if lookup:
+                got = collection.get(ids=list(set(lookup.values())), include=["embeddings"])
+                by_id = dict(zip(got["ids"], got["embeddings"]))
+                stored.update((h, by_id[cid]) for h, cid in lookup.items() if cid in by_id)
+            todo = [i for i, r in enumerate(batch) if r["hash"] not in stored]
+            yield batch, stored, todo
+
+    if workers <= 1:
+        for batch, stored, todo in prepared():
+            fresh = _model([batch[i]["document"] for i in todo]) if todo else []
+            yield batch, _merge_embeddings(batch, stored, todo, fresh)
+        return
+
+    # Every worker checks its model against the main process's on this probe
+    reference = _model(_WORKER_PROBE)
+    with ProcessPoolExecutor(
+        workers, mp_context=mp.get_context("spawn"), initializer=_init_worker, initargs=(reference,)
+    ) as pool:
+        pending: deque = deque()
+        for batch, stored, todo in prepared():
+            future = pool.submit(_embed_in_worker, [batch[i]["document"] for i in todo])
+            pending.append((batch, stored, todo, future))
+            if len(pending) >= 2 * workers:
+                batch, stored, todo, future = pending.popleft()
+                yield batch, _merge_embeddings(batch, stored, todo, future.result())
+        while pending:
+            batch, stored, todo, future = pending.popleft()
+            yield batch, _merge_embeddings(batch, stored, todo, future.result())
+
+
+def _merge_embeddings(batch: list[dict], stored: dict, todo: list[int], fresh: list) -> list:
+    embeddings = [stored.get(r["hash"]) for r in batch]
+    for i, vec in zip(todo, fresh):
+        embeddings[i] = vec
+    return embeddings
+
+
+# ---------------------------------------------------------------------------
+# Embedding worker processes
+# ---------------------------------------------------------------------------
+_worker_model = None
+_WORKER_PROBE = ["Worker self-check: 向量检索 with ONNX"]
+
+
+class _SingleThreadMiniLM:
+    """all-MiniLM-L6-v2 on a single-threaded ONNX session; same vectors as ONNXMiniLM_L6_V2.
+
+    N single-threaded processes scale much better than one session spreading
+    small batches over N intra-op threads, and chromadb's class has no option
+    for the thread count. This loads the files it downloads (tokenizer.json +
+    model.onnx) into a session of our own and repeats its mean pooling.
+    """
+
+    def __init__(self):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(ONNXMiniLM_L6_V2.DOWNLOAD_PATH) / ONNXMiniLM_L6_V2.EXTRACTED_FOLDER_NAME
+        if not (model_dir / "model.onnx").exists():
+            ONNXMiniLM_L6_V2()(["download"])  # fetches the model the supported way
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=256)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]", length=256)
+        so = ort.SessionOptions()
+        so.log_severity_level = 3
+        so.intra_op_num_threads = 1
+        so.inter_op_num_threads = 1
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(model_dir / "model.onnx"), sess_options=so, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, docs: list[str], batch_size: int = 32) -> list[np.ndarray]:
+        vectors = []
+        for i in range(0, len(docs), batch_size):
+            encoded = self.tokenizer.encode_batch(docs[i : i + batch_size])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            hidden = self.session.run(
+                None, {"input_ids": input_ids, "attention_mask": mask, "token_type_ids": np.zeros_like(input_ids)}
+            )[0]
+            # Mean pooling over real tokens, then unit length
+            weights = mask[:, :, None]
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            vectors.extend((pooled / np.maximum(norms, 1e-12)).astype(np.float32))
+        return vectors
+
+
+def _init_worker(reference: list) -> None:
+    """Load the model once per worker, pinned to one ONNX thread.
+
+    Falls back to chromadb's own (all-cores) model, with a warning, when the
+    single-threaded one cannot be built or does not reproduce reference, the
+    main process's embedding of _WORKER_PROBE (e.g. after a chromadb upgrade
+    changes the model files or pooling).
+    """
+    global _worker_model
+    try:
+        model = _SingleThreadMiniLM()
+        if not np.allclose(model(_WORKER_PROBE), reference, atol=1e-5):
+            raise ValueError("its embeddings differ from ONNXMiniLM_L6_V2")
+    except Exception as e:
+        print(f"[ingest] worker {os.getpid()}: single-threaded model unavailable ({e}); using chromadb's default")
+        model = ONNXMiniLM_L6_V2()
+    _worker_model = model
+
+
+def _embed_in_worker(docs: list[str]) -> list:
+    if not docs:
+        return []
+    return _worker_model(docs)
+
+
 if __name__ == "__main__":
-    ingest()
+    parser = argparse.ArgumentParser(description="Ingest notes into ChromaDB")
+    parser.add_argument("--full", action="store_true", help="drop and rebuild the collection from scratch")
+    parser.add_argument(
+        "--batch-size", type=int, default=INGEST_BATCH_SIZE, help="chunks embedded and stored per flush"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=INGEST_WORKERS, help="embedding processes (1 = embed in this process)"
+    )
+    parser.add_argument(
+        "--corpus", action="append", choices=list(CORPORA), help="only ingest this corpus (repeatable; default: all)"
+    )
+    args = parser.parse_args()
+    ingest_all(full=args.full, batch_size=args.batch_size, workers=args.workers, corpora=args.corpus)
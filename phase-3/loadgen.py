@@ -0,0 +1,251 @@
+"""
+Phase 3 - Concurrent load generator for the retriever
+
+Usage:
+    uv run python phase-3/loadgen.py --concurrency 8 --duration 20
+    uv run python phase-3/loadgen.py --mode process --concurrency 4 --no-cache
+    uv run python phase-3/loadgen.py --api batch --batch-size 8 --concurrency 4
+    uv run python phase-3/loadgen.py --mode async --concurrency 64 --report load.json
+
+What it does:
+    N workers call the retriever in a closed loop (each sends its next request
+    as soon as the previous one returns) for --duration seconds or --requests
+    requests, with queries drawn from eval.py's QA_PAIRS plus synthetic
+    paraphrases of them (--paraphrase-ratio). Reports throughput, latency
+    percentiles and error rate, broken down by exception type.
+
+    --mode thread   N threads in one process, sharing one collection handle
+    --mode process  N processes, each with its own PersistentClient: the
+                    setup that exposes SQLite lock contention in chroma_db
+    --mode async    N concurrent asearch_notes() calls on one event loop
+                    (bounded by RETRIEVER_THREADS / RETRIEVER_MAX_CONCURRENCY)
+
+    --api single|batch picks search_notes() or search_notes_batch().
+    --no-cache turns off the result and query-embedding caches so every
+    request pays for a full search; otherwise repeats are mostly cache hits.
+
+    Sizing worker pools: raise --concurrency until QPS stops growing; the
+    p99 climbing while QPS is flat means requests are queueing.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import retriever
+from cache import EmbeddingCache, ResultCache
+from eval import QA_PAIRS, _latency_summary
+
+# Prefix / suffix templates for synthetic paraphrases of the QA questions
+_PARAPHRASE_TEMPLATES = [
+    "请问{q}",
+    "{q}能详细解释一下吗",
+    "简单说说：{q}",
+    "我想了解一下，{q}",
+    "{q}（最好举个例子）",
+    "关于笔记里的内容：{q}",
+]
+
+
+def paraphrases(question: str) -> list[str]:
+    """Deterministic rewordings of a question (same intent, different text)."""
+    core = question.rstrip("？?")
+    return [template.format(q=core) for template in _PARAPHRASE_TEMPLATES]
+
+
+def query_mix(paraphrase_ratio: float, seed: int = 0, size: int = 1000) -> list[str]:
+    """size queries: QA questions, and paraphrases of them with probability paraphrase_ratio."""
+    rng = random.Random(seed)
+    mix = []
+    for _ in range(size):
+        question, _ = rng.choice(QA_PAIRS)
+        mix.append(rng.choice(paraphrases(question)) if rng.random() < paraphrase_ratio else question)
+    return mix
+
+
+def _configure(no_cache: bool) -> None:
+    """Per-process retriever setup: optionally drop the caches, then warm up."""
+    if no_cache:
+        retriever._result_cache = ResultCache(maxsize=0)
+        retriever._query_cache = EmbeddingCache(maxsize=0)
+    retriever.warm_up()
+
+
+def _call(api: str, queries: list[str], top_k: int) -> None:
+    if api == "batch":
+        retriever.search_notes_batch(queries, top_k=top_k)
+    else:
+        retriever.search_notes(queries[0], top_k=top_k)
+
+
+def _run_worker(
+    worker: int, api: str, queries: list[str], top_k: int, batch_size: int, duration: float, requests: int
+) -> list[tuple[float, float, int, str | None]]:
+    """Closed loop until duration seconds pass or requests are sent.
+
+    Returns (start offset s, latency ms, queries in the request, error type or None) per request.
+    """
+    rng = random.Random(worker)
+    samples = []
+    n = batch_size if api == "batch" else 1
+    started = time.perf_counter()
+    while len(samples) < requests and time.perf_counter() - started < duration:
+        batch = [rng.choice(queries) for _ in range(n)]
+        t0 = time.perf_counter()
+        error = None
+        try:
+            _call(api, batch, top_k)
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)[:80]}"
+        samples.append((t0 - started, (time.perf_counter() - t0) * 1000, n, error))
+    return samples
+
+
+def _process_worker(args: tuple) -> list[tuple[float, float, int, str | None]]:
+    # Every process has spawned and warmed up before any of them starts sending
+    barrier, *worker_args = args
+    barrier.wait()
+    return _run_worker(*worker_args)
+
+
+async def _run_async(
+    concurrency: int, queries: list[str], top_k: int, duration: float, requests: int
+) -> list[tuple[float, float, int, str | None]]:
+    samples: list[tuple[float, float, int, str | None]] = []
+    started = time.perf_counter()
+
+    async def worker(worker_id: int) -> None:
+        rng = random.Random(worker_id)
+        while len(samples) < requests and time.perf_counter() - started < duration:
+            t0 = time.perf_counter()
+            error = None
+            try:
+                await retriever.asearch_notes(rng.choice(queries), top_k=top_k)
+            except Exception as e:
+                error = f"{type(e).__name__}: {str(e)[:80]}"
+            samples.append((t0 - started, (time.perf_counter() - t0) * 1000, 1, error))
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return samples
+
+
+def run_load(
+    mode: str = "thread",
+    api: str = "single",
+    concurrency: int = 4,
+    duration: float = 10,
+    requests: int | None = None,
+    top_k: int = 3,
+    batch_size: int = 8,
+    paraphrase_ratio: float = 0.5,
+    no_cache: bool = False,
+    report_path: str | Path | None = None,
+) -> dict:
+    queries = query_mix(paraphrase_ratio)
+    # Without a request budget the duration is the only limit
+    per_worker = -(-requests // concurrency) if requests else float("inf")
+    if requests:
+        duration = float("inf")
+
+    if mode == "process":
+        ctx = mp.get_context("spawn")
+        with ctx.Manager() as manager, ProcessPoolExecutor(
+            concurrency, mp_context=ctx, initializer=_configure, initargs=(no_cache,)
+        ) as pool:
+            barrier = manager.Barrier(concurrency)
+            jobs = [(barrier, i, api, queries, top_k, batch_size, duration, per_worker) for i in range(concurrency)]
+            results = list(pool.map(_process_worker, jobs))
+        samples = [s for worker in results for s in worker]
+        # Workers start together at the barrier; the run lasts until the last request returns
+        elapsed = max((offset + latency / 1000 for offset, latency, _, _ in samples), default=0.0)
+    else:
+        _configure(no_cache)
+        started = time.perf_counter()
+        if mode == "async":
+            samples = asyncio.run(_run_async(concurrency, queries, top_k, duration, requests or float("inf")))
+        else:
+            with ThreadPoolExecutor(concurrency) as pool:
+                futures = [
+                    pool.submit(_run_worker, i, api, queries, top_k, batch_size, duration, per_worker)
+                    for i in range(concurrency)
+                ]
+                samples = [s for future in futures for s in future.result()]
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for _, latency, _, error in samples if error is None]
+    errors = Counter(error for _, _, _, error in samples if error is not None)
+    report = {
+        "config": {
+            "mode": mode,
+            "api": "async" if mode == "async" else api,
+            "concurrency": concurrency,
+            "top_k": top_k,
+            "batch_size": batch_size if api == "batch" else 1,
+            "paraphrase_ratio": paraphrase_ratio,
+            "no_cache": no_cache,
+            "backend": retriever.SEARCH_BACKEND,
+            "collections": retriever.SEARCH_COLLECTIONS,
+        },
+        "seconds": elapsed,
+        "requests": len(samples),
+        "queries": sum(n for _, _, n, _ in samples),
+        "errors": sum(errors.values()),
+        "error_rate": sum(errors.values()) / max(len(samples), 1),
+        "error_types": dict(errors.most_common()),
+        "rps": len(samples) / elapsed,
+        "qps": sum(n for _, _, n, error in samples if error is None) / elapsed,
+        "latency_ms": _latency_summary(latencies),
+    }
+    if mode != "process":
+        report["retriever_stats"] = retriever.retriever_stats()
+
+    lat = report["latency_ms"]
+    print(f"{'='*60}")
+    print(
+        f"压测 mode={mode} api={report['config']['api']} concurrency={concurrency} "
+        f"top_k={top_k} no_cache={no_cache}"
+    )
+    print(f"{'='*60}")
+    print(f"requests: {report['requests']}  queries: {report['queries']}  in {elapsed:.1f}s")
+    print(f"throughput: {report['rps']:.1f} req/s, {report['qps']:.1f} queries/s")
+    print(
+        f"latency ms: mean {lat['mean']:.1f}  p50 {lat['p50']:.1f}  p95 {lat['p95']:.1f}  "
+        f"p99 {lat['p99']:.1f}  max {lat['max']:.1f}"
+    )
+    print(f"errors: {report['errors']} ({report['error_rate'] * 100:.2f}%)")
+    for error, count in errors.most_common(5):
+        print(f"  {count:>6} x {error}")
+    if report_path:
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n报告已写入 {report_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load generator for search_notes")
+    parser.add_argument("--mode", choices=["thread", "process", "async"], default="thread")
+    parser.add_argument("--api", choices=["single", "batch"], default="single", help="ignored in async mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="threads / processes / in-flight coroutines")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--requests", type=int, help="stop after this many requests instead of --duration")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=8, help="queries per search_notes_batch() call")
+    parser.add_argument("--paraphrase-ratio", type=float, default=0.5, help="share of paraphrased questions")
+    parser.add_argument("--no-cache", action="store_true", help="disable the result and query-embedding caches")
+    parser.add_argument("--report", help="write the report to this JSON file")
+    args = parser.parse_args()
+    run_load(
+        mode=args.mode, api=args.api, concurrency=args.concurrency, duration=args.duration, requests=args.requests,
+        top_k=args.top_k, batch_size=args.batch_size, paraphrase_ratio=args.paraphrase_ratio,
+        no_cache=args.no_cache, report_path=args.report,
+    )
@@ -2,65 +2,933 @@
 Phase 3 - Step 2: Retrieval tool
 
 This module exposes:
-    - search_notes(query, top_k) -> str   (plain function for testing)
+    - search_notes(query, top_k, ...) -> str
+                                          (plain function for testing; mode = "hybrid" | "vector",
+                                           rerank = optional CPU rerank of over-fetched candidates,
+                                           min_score = drop passages below this similarity,
+                                           expand = merge in N neighbouring chunks per hit,
+                                           mmr = diversity-aware selection of the top_k,
+                                           sources / tags = metadata pre-filters)
+    - search_notes_batch(queries, top_k) -> list[str]
+                                          (one embedding batch + one vector query per shard)
+    - asearch_notes / asearch_notes_batch (async versions for event-loop servers)
     - SEARCH_TOOL_SCHEMA                  (JSON schema for LLM tool calling)
-    - run_search_tool(args_dict) -> str   (dispatcher used by agent.py)
+    - run_search_tool(args_dict) -> str   (dispatcher used by agent.py; async: arun_search_tool)
+    - invalidate_collection(name)         (drop cached collection handles)
+    - retriever_stats() -> dict           (counters for opens / reopens / cache hits)
+    - warm_up() -> dict                   (load the model, open every shard, run one query; agent.py startup)
+
+Shards (SEARCH_COLLECTIONS):
+    ingest.py builds one collection per corpus (phase-3 notes, phase-4 notes).
+    A search fans out to all of them in parallel and merges one global top_k.
+
+Vector backend (SEARCH_BACKEND):
+    Small collections are searched exactly with NumPy (vector_index.py) from
+    the matrix ingest.py exports; larger ones go through Chroma's HNSW index.
+    Compare both with: uv run python phase-3/bench.py backend
 """
 
 from __future__ import annotations
 
+import asyncio
+import functools
 import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import chromadb
+import chromadb.errors
+import numpy as np
 from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from bm25 import BM25Index, tokenize
+from cache import EmbeddingCache, ResultCache, normalize_query, text_key
+from vector_index import NumpyIndex, quantized_path
+
 load_dotenv()
 
 CHROMA_DIR = Path(__file__).parent / "chroma_db"
 COLLECTION_NAME = "notes"
 
+# Must match ingest.py: ingest writes <META_DIR>/<collection>.version after every
+# rebuild, and <collection>.bm25.json for hybrid search
+META_DIR = Path(__file__).parent / "chroma_meta"
+
 # Must match the embedding function used in ingest.py
 _embed_fn = DefaultEmbeddingFunction()
+# Same model as DefaultEmbeddingFunction, but kept as one instance:
+# DefaultEmbeddingFunction builds a new ONNX session on every call.
+_query_model = ONNXMiniLM_L6_V2()
+# The ONNX session (and the ~90MB model download on a fresh machine) is created
+# lazily on the first call; this lock keeps a warm-up thread and the first real
+# query from doing it twice.
+_model_lock = threading.Lock()
+_model_loaded = False
+
+# Query embedding cache: in-memory LRU, plus an optional SQLite file that
+# survives restarts (set QUERY_CACHE_DB=phase-3/chroma_meta/query_cache.sqlite)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_DB = os.getenv("QUERY_CACHE_DB", "")
+_query_cache = EmbeddingCache(QUERY_CACHE_SIZE, QUERY_CACHE_DB or None, namespace="all-MiniLM-L6-v2")
+
+# Formatted-result cache keyed on (collection version, options, top_k, search
+# settings, normalized query).
+# RESULT_CACHE_DB points at a SQLite file shared by several worker processes.
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")
+_result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL or None, RESULT_CACHE_DB or None)
+
+# Vector search backend:
+#   "chroma": Chroma's HNSW index
+#   "numpy":  exact brute force over all embeddings in one float32 matrix
+#   "auto":   numpy while the collection has at most NUMPY_MAX_CHUNKS chunks
+# NUMPY_MMAP=1 memory-maps the matrix exported by ingest.py instead of loading it.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+NUMPY_MAX_CHUNKS = int(os.getenv("NUMPY_MAX_CHUNKS", "20000"))
+NUMPY_MMAP = os.getenv("NUMPY_MMAP", "0") == "1"
+# VECTOR_QUANTIZATION=int8|binary: the NumPy backend shortlists QUANTIZED_RESCORE * k
+# rows on quantized codes and re-ranks them with the (memory-mapped) float rows.
+# Cuts resident memory ~4x (int8) / ~32x (binary), so "auto" allows that many more chunks.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "")
+QUANTIZED_RESCORE = int(os.getenv("QUANTIZED_RESCORE", "4"))
+_QUANTIZATION_RATIO = {"": 1, "int8": 4, "binary": 32}
+
+# Passages whose similarity (cosine, see _similarity) is below MIN_SCORE are
+# dropped instead of being sent to the LLM; fewer than top_k may come back.
+MIN_SCORE = float(os.getenv("MIN_SCORE", "0"))
+
+# Topic tags ingest.py stores as tag_<name>=True metadata; searches can be
+# restricted to them. Must match TOPIC_TAGS in ingest.py.
+TOPIC_TAGS = ["mcp", "function_calling", "langgraph", "embedding", "rag", "agent_patterns"]
+
+# MMR (maximal marginal relevance): pick the top_k out of MMR_CANDIDATES so that
+# each next passage is relevant but unlike the ones already picked.
+# MMR_LAMBDA = 1 is pure relevance, lower values favour diversity.
+MMR = os.getenv("MMR", "0") == "1"
+MMR_CANDIDATES = int(os.getenv("MMR_CANDIDATES", "20"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# Neighbour expansion: each hit is widened with EXPAND_NEIGHBORS chunks on either
+# side (same file, by chunk_index) and overlapping / adjacent passages are merged.
+# 0 turns it off.
+EXPAND_NEIGHBORS = int(os.getenv("EXPAND_NEIGHBORS", "0"))
+
+# "hybrid": vector + BM25 fused with reciprocal rank fusion (needs the BM25
+# index ingest.py writes; falls back to vector-only without it). "vector": Chroma only.
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")
+# Each ranking contributes top_k * this many candidates to the fusion
+HYBRID_CANDIDATES_FACTOR = int(os.getenv("HYBRID_CANDIDATES_FACTOR", "4"))
+RRF_K = 60  # standard RRF constant: damps the weight of the very top ranks
+
+# Optional rerank stage: over-fetch RERANK_CANDIDATES, rescore on CPU, keep top_k.
+# Skipped (first-stage order kept) once the search has spent RERANK_BUDGET_MS.
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "50"))
+RERANK_WEIGHT = float(os.getenv("RERANK_WEIGHT", "0.6"))  # share of term coverage vs. first-stage rank
+
+# Collections searched as shards of one knowledge base (one per corpus, see
+# CORPORA in ingest.py). Each query fans out to all of them concurrently and
+# the candidates are merged into a global top_k. Missing ones are skipped.
+SEARCH_COLLECTIONS = [name for name in os.getenv("SEARCH_COLLECTIONS", "notes,phase4_notes").split(",") if name]
+
+# Async API: searches run on RETRIEVER_THREADS shared worker threads, and at most
+# RETRIEVER_MAX_CONCURRENCY of them are in flight per event loop (the rest wait
+# on a semaphore, so cancelled requests never reach the pool).
+RETRIEVER_THREADS = int(os.getenv("RETRIEVER_THREADS", "4"))
+RETRIEVER_MAX_CONCURRENCY = int(os.getenv("RETRIEVER_MAX_CONCURRENCY", "16"))
+
+# ---------------------------------------------------------------------------
+# Process-wide collection handle
+# ---------------------------------------------------------------------------
+# Opening a PersistentClient + collection means opening SQLite and loading the
+# HNSW segment, so we do it once and reuse the handle for every query.
+# The handle is reopened only when ingest.py bumps the version stamp
+# (or when invalidate_collection() is called explicitly).
+_lock = threading.Lock()
+_client: chromadb.ClientAPI | None = None
+# Per collection name: (version, value), reloaded when the version stamp changes
+_collections: dict[str, tuple[str, chromadb.Collection]] = {}
+_bm25: dict[str, tuple[str, BM25Index | None]] = {}
+_numpy_index: dict[str, tuple[str, NumpyIndex | None]] = {}
+_version_cache: dict[str, tuple[int, str]] = {}  # name -> (mtime_ns, version)
+_stats = {
+    "collection_opens": 0,
+    "collection_reopens": 0,
+    "bm25_loads": 0,
+    "numpy_loads": 0,
+    "rerank_runs": 0,
+    "rerank_skipped": 0,
+}
+
 
+def _read_version(name: str = COLLECTION_NAME) -> str:
+    """Return the version stamp ingest.py wrote for a collection ("" if there is none yet).
+
+    Only a stat() per call; the file is re-read when its mtime changes.
+    """
+    path = META_DIR / f"{name}.version"
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return ""
+    cached = _version_cache.get(name)
+    if cached is None or cached[0] != mtime:
+        cached = _version_cache[name] = (mtime, path.read_text(encoding="utf-8").strip())
+    return cached[1]
+
+
+def _get_collection(name: str = COLLECTION_NAME) -> chromadb.Collection:
+    global _client
+    version = _read_version(name)
+    cached = _collections.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _lock:
+        # Another thread may have reopened it while we waited for the lock
+        cached = _collections.get(name)
+        if cached is None or cached[0] != version:
+            if _client is None:
+                _client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+            if cached is not None:
+                _stats["collection_reopens"] += 1
+            cached = _collections[name] = (version, _client.get_collection(name, embedding_function=_embed_fn))
+            _stats["collection_opens"] += 1
+        return cached[1]
+
+
+def _get_bm25(name: str = COLLECTION_NAME) -> BM25Index | None:
+    """The BM25 index for the current collection version, loaded once per version."""
+    version = _read_version(name)
+    cached = _bm25.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _bm25.get(name)
+        if cached is None or cached[0] != version:
+            path = META_DIR / f"{name}.bm25.json"
+            cached = _bm25[name] = (version, BM25Index.load(path) if path.exists() else None)
+            _stats["bm25_loads"] += 1
+        return cached[1]
+
+
+def _get_numpy_index(collection: chromadb.Collection, name: str = COLLECTION_NAME) -> NumpyIndex | None:
+    """The NumPy index for the current version, or None when the chroma backend applies."""
+    if SEARCH_BACKEND == "chroma":
+        return None
+    version = _read_version(name)
+    cached = _numpy_index.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _numpy_index.get(name)
+        if cached is None or cached[0] != version:
+            index = None
+            max_chunks = NUMPY_MAX_CHUNKS * _QUANTIZATION_RATIO[VECTOR_QUANTIZATION]
+            if SEARCH_BACKEND == "numpy" or collection.count() <= max_chunks:
+                space = (collection.configuration.get("hnsw") or {}).get("space", "l2")
+                vectors_path = META_DIR / f"{name}.vectors.npy"
+                rows_path = META_DIR / f"{name}.rows.jsonl"
+                quantized = VECTOR_QUANTIZATION and quantized_path(vectors_path, VECTOR_QUANTIZATION)
+                if vectors_path.exists() and rows_path.exists() and (not quantized or quantized.exists()):
+                    index = NumpyIndex.load(
+                        vectors_path,
+                        rows_path,
+                        space,
+                        mmap=NUMPY_MMAP,
+                        quantization=VECTOR_QUANTIZATION or None,
+                        rescore=QUANTIZED_RESCORE,
+                    )
+                else:
+                    index = NumpyIndex.from_collection(collection)
+                _stats["numpy_loads"] += 1
+            cached = _numpy_index[name] = (version, index)
+        return cached[1]
 
-def _get_collection() -> chromadb.Collection:
-    chroma = chromadb.PersistentClient(path=str(CHROMA_DIR))
-    return chroma.get_collection(COLLECTION_NAME, embedding_function=_embed_fn)
 
+def _get_store(name: str = COLLECTION_NAME) -> chromadb.Collection | NumpyIndex:
+    """What vector queries run against: the NumPy index if the backend picks it, else Chroma."""
+    collection = _get_collection(name)
+    return _get_numpy_index(collection, name) or collection
 
 
-def search_notes(query: str, top_k: int = 3) -> str:
-    """Search the local notes ChromaDB by semantic similarity.
+def invalidate_collection(name: str | None = None) -> None:
+    """Forget cached collections (and BM25 / NumPy indexes) so the next query reloads them.
 
-    Returns a formatted string of top-k relevant passages with their sources.
-    ChromaDB auto-embeds the query using the same local embedding function as ingest.
+    name=None forgets every collection.
     """
-    collection = _get_collection()
-    results = collection.query(
-        query_texts=[query],  # ChromaDB auto-embeds using _embed_fn
-        n_results=min(top_k, collection.count()),
-        include=["documents", "metadatas", "distances"],
-    )
+    with _lock:
+        for cache in (_collections, _bm25, _numpy_index):
+            if name is None:
+                cache.clear()
+            else:
+                cache.pop(name, None)
+
+
+def retriever_stats() -> dict:
+    """Snapshot of the retriever's internal counters."""
+    stats = dict(_stats)
+    for name, value in _query_cache.stats.items():
+        stats[f"query_cache_{name}"] = value
+    for name, value in _result_cache.stats.items():
+        stats[f"result_cache_{name}"] = value
+    return stats
+
+
+def _load_query_model() -> None:
+    """Make sure the query model's ONNX session exists (downloads the model if needed)."""
+    global _model_loaded
+    if _model_loaded:
+        return
+    with _model_lock:
+        if not _model_loaded:
+            _query_model(["warm up"])
+            _model_loaded = True
+
+
+def _embed_queries(queries: list[str]) -> list:
+    """Embed queries, skipping the ONNX forward pass for anything cached."""
+    _load_query_model()
+    return _query_cache.get_many([normalize_query(q) for q in queries], _query_model)
+
+
+def _with_collection(op, collection: chromadb.Collection | None = None, name: str = COLLECTION_NAME):
+    """Run op(store) on the given collection, or on the shared store of `name` (see _get_store).
+
+    The shared handle gets one retry in case the collection was rebuilt
+    under us without a version bump.
+    """
+    if collection is not None:
+        return op(collection)
+    try:
+        return op(_get_store(name))
+    except chromadb.errors.NotFoundError:
+        invalidate_collection(name)
+        return op(_get_store(name))
+
+
+def _where(sources: list[str] | None, tags: list[str] | None) -> dict | None:
+    """Chroma where clause for the source / tag filters (None = no filter)."""
+    clauses = []
+    if sources:
+        clauses.append({"source": {"$in": list(sources)}})
+    if tags:
+        unknown = set(tags) - set(TOPIC_TAGS)
+        if unknown:
+            raise ValueError(f"Unknown tags: {sorted(unknown)} (expected some of {TOPIC_TAGS})")
+        by_tag = [{f"tag_{tag}": True} for tag in tags]
+        clauses.append(by_tag[0] if len(by_tag) == 1 else {"$or": by_tag})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _query(
+    collection: chromadb.Collection,
+    embeddings: list,
+    n_results: int,
+    with_embeddings: bool = False,
+    where: dict | None = None,
+) -> list[list[dict]]:
+    """Vector query; with_embeddings=True also puts each hit's vector in hit["embedding"]."""
+    # n_results larger than the collection is fine: Chroma returns what it has
+    include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else [])
+    results = collection.query(query_embeddings=embeddings, n_results=n_results, where=where, include=include)
+    all_vectors = results["embeddings"] if with_embeddings else [None] * len(results["ids"])
+    all_hits = []
+    for ids, docs, metas, distances, vectors in zip(
+        results["ids"], results["documents"], results["metadatas"], results["distances"], all_vectors
+    ):
+        hits = [
+            {"id": id_, "document": doc, "metadata": meta or {}, "distance": dist}
+            for id_, doc, meta, dist in zip(ids, docs, metas, distances)
+        ]
+        if with_embeddings:
+            for hit, vector in zip(hits, vectors):
+                hit["embedding"] = np.asarray(vector, dtype=np.float32)
+        all_hits.append(hits)
+    return all_hits
+
+
+def _distance(space: str, query: np.ndarray, vector: np.ndarray) -> float:
+    """Same distance Chroma reports for the given hnsw space."""
+    if space == "cosine":
+        return float(1 - query @ vector / (np.linalg.norm(query) * np.linalg.norm(vector) or 1.0))
+    if space == "ip":
+        return float(1 - query @ vector)
+    return float(np.sum((query - vector) ** 2))  # "l2" is squared L2 in Chroma
+
+
+def _similarity(space: str, distance: float) -> float:
+    """Turn the distance Chroma reports for the given hnsw space back into a similarity.
+
+    MiniLM vectors are unit length, so for "l2" (squared L2, = 2 - 2cos) this
+    is the cosine similarity too; for "ip" it is the dot product.
+    """
+    if space == "l2":
+        return 1 - distance / 2
+    return 1 - distance
+
+
+def _keyword_hits(
+    collection: chromadb.Collection,
+    queries: list[str],
+    embeddings: list,
+    vector_hits: list[list[dict]],
+    bm25: BM25Index,
+    n_candidates: int,
+    where: dict | None = None,
+    corpus: list[BM25Index] | None = None,
+) -> list[list[dict]]:
+    """The BM25 ranking of one collection as hits, each with its BM25 score in hit["bm25"].
+
+    corpus is every shard's BM25 index: scores then use corpus-wide IDF and
+    document length, so _merge_shards can compare them across shards.
+
+    Documents the vector query did not return are fetched with ONE batched
+    get() for all queries (their distance is computed here). With a where
+    filter, BM25 only scores the ids that pass it (one more get()).
+    """
+    allowed = collection.get(where=where, include=[])["ids"] if where else None
+    keyword = [bm25.search(q, n_candidates, allowed, corpus) for q in queries]
+
+    # Missing per query: another query's vector hits do not make a document known here
+    missing = sorted({
+        doc_id
+        for hits, ranked in zip(vector_hits, keyword)
+        for doc_id in {doc_id for doc_id, _ in ranked} - {hit["id"] for hit in hits}
+    })
+    fetched: dict[str, tuple[dict, np.ndarray]] = {}
+    if missing:
+        got = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+        for id_, doc, meta, emb in zip(got["ids"], got["documents"], got["metadatas"], got["embeddings"]):
+            fetched[id_] = ({"id": id_, "document": doc, "metadata": meta or {}}, np.asarray(emb, dtype=np.float32))
+
+    space = (collection.configuration.get("hnsw") or {}).get("space", "l2")
+    keyword_all = []
+    for query_emb, hits, ranked in zip(embeddings, vector_hits, keyword):
+        by_id = {hit["id"]: hit for hit in hits}
+        keyword_hits = []
+        for doc_id, score in ranked:
+            if doc_id not in by_id:
+                if doc_id not in fetched:
+                    continue  # deleted since the BM25 index was built
+                hit, vector = fetched[doc_id]
+                distance = _distance(space, np.asarray(query_emb), vector)
+                by_id[doc_id] = {**hit, "distance": distance, "embedding": vector}
+            by_id[doc_id]["bm25"] = score
+            keyword_hits.append(by_id[doc_id])
+        keyword_all.append(keyword_hits)
+    return keyword_all
+
+
+def _fuse(vector_hits: list[dict], keyword_hits: list[dict]) -> list[dict]:
+    """Reciprocal rank fusion of one query's vector ranking and BM25 ranking.
+
+    score(doc) = sum over rankings of 1 / (RRF_K + rank). Hits are keyed by
+    (collection, id), so both rankings may span several shards.
+    """
+    scores: dict[tuple, float] = {}
+    by_key: dict[tuple, dict] = {}
+    for ranking in (vector_hits, keyword_hits):
+        for rank, hit in enumerate(ranking):
+            key = (hit["collection"], hit["id"])
+            by_key.setdefault(key, hit)
+            scores[key] = scores.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [by_key[key] for key in ranked]
+
+
+def _rerank(query: str, hits: list[dict], bm25: BM25Index | None) -> list[dict]:
+    """Cheap CPU rerank: IDF-weighted query-term coverage blended with first-stage rank.
+
+    A passage that contains the rare words of the question (identifiers,
+    product names) moves up; the first-stage order breaks ties.
+    """
+    terms = set(tokenize(query))
+    if not terms or len(hits) < 2:
+        return hits
+    weights = {t: bm25.idf(t) if bm25 is not None else 1.0 for t in terms}
+    total = sum(weights.values()) or 1.0
+
+    def score(rank: int, hit: dict) -> float:
+        doc_terms = set(tokenize(f"{hit['metadata'].get('headings', '')}\n{hit['document']}"))
+        coverage = sum(w for t, w in weights.items() if t in doc_terms) / total
+        prior = 1 - rank / len(hits)
+        return RERANK_WEIGHT * coverage + (1 - RERANK_WEIGHT) * prior
+
+    scored = sorted(enumerate(hits), key=lambda item: score(*item), reverse=True)
+    return [hit for _, hit in scored]
+
+
+def _mmr(hits: list[dict], k: int, lambda_: float = MMR_LAMBDA) -> list[dict]:
+    """Greedy maximal marginal relevance over hits that carry hit["embedding"].
+
+    Each step picks argmax  lambda_ * score - (1 - lambda_) * max cosine to the picked ones,
+    so near-duplicate chunks (same file, overlapping text) stop crowding the top_k.
+    """
+    if len(hits) <= 1 or k <= 0:
+        return hits[:k]
+    vectors = np.stack([hit["embedding"] for hit in hits])
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    relevance = np.array([hit["score"] for hit in hits])
+    redundancy = np.zeros(len(hits))
+    picked: list[int] = []
+    for _ in range(min(k, len(hits))):
+        marginal = lambda_ * relevance - (1 - lambda_) * redundancy
+        marginal[picked] = -np.inf
+        best = int(np.argmax(marginal))
+        picked.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return [hits[i] for i in picked]
+
+
+def _chunk_id(source: str, chunk_index: int) -> str:
+    # Must match the ids ingest.iter_file_chunks() writes
+    return f"{Path(source).stem}_chunk_{chunk_index}"
+
 
-    docs = results["documents"][0]
-    metas = results["metadatas"][0]
-    distances = results["distances"][0]
+def _merge_chunks(chunks: list[dict]) -> str:
+    """Join chunks of one file in offset order, dropping the text they overlap by."""
+    parts: list[str] = []
+    end = -1
+    for chunk in sorted(chunks, key=lambda c: c["metadata"]["start"]):
+        start, stop = chunk["metadata"]["start"], chunk["metadata"]["end"]
+        if start < end:
+            if stop > end:
+                parts.append(chunk["document"][end - start :])
+                end = stop
+        else:
+            parts.append(chunk["document"] if not parts else "\n\n" + chunk["document"])
+            end = stop
+    return "".join(parts)
 
-    if not docs:
+
+def _expand(collection: chromadb.Collection, all_hits: list[list[dict]], window: int) -> list[list[dict]]:
+    """Widen every hit with its `window` neighbours on each side and merge passages.
+
+    Neighbours missing from the hits are fetched with ONE batched get() for all
+    queries. Hits whose windows overlap or touch (same file) become one passage,
+    ranked and scored like the best hit in it, so a query can get back fewer
+    passages than hits.
+    """
+    known: dict[str, dict] = {hit["id"]: hit for hits in all_hits for hit in hits}
+    wanted: set[str] = set()
+    for hit in known.values():
+        meta = hit["metadata"]
+        if "chunk_index" in meta and "start" in meta:
+            first = max(0, meta["chunk_index"] - window)
+            wanted.update(_chunk_id(meta["source"], i) for i in range(first, meta["chunk_index"] + window + 1))
+    missing = sorted(wanted - known.keys())
+    chunks = dict(known)
+    if missing:
+        got = collection.get(ids=missing, include=["documents", "metadatas"])
+        for id_, doc, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+            chunks[id_] = {"id": id_, "document": doc, "metadata": meta or {}}
+
+    expanded_all = []
+    for hits in all_hits:
+        passages: list[tuple[dict, set[int]]] = []  # (best hit, chunk indexes), best first
+        for hit in hits:
+            meta = hit["metadata"]
+            if "chunk_index" not in meta or "start" not in meta:
+                passages.append((hit, set()))
+                continue
+            span = set(range(max(0, meta["chunk_index"] - window), meta["chunk_index"] + window + 1))
+            for best, indexes in passages:
+                same_file = best["metadata"].get("source") == meta["source"] and indexes
+                if same_file and min(span) <= max(indexes) + 1 and max(span) >= min(indexes) - 1:
+                    indexes.update(span)
+                    break
+            else:
+                passages.append((hit, span))
+
+        expanded = []
+        for best, indexes in passages:
+            if not indexes:
+                expanded.append(best)
+                continue
+            source = best["metadata"]["source"]
+            parts = [chunks[cid] for cid in (_chunk_id(source, i) for i in sorted(indexes)) if cid in chunks]
+            metadata = {
+                **best["metadata"],
+                "start": min(c["metadata"]["start"] for c in parts),
+                "end": max(c["metadata"]["end"] for c in parts),
+            }
+            expanded.append({**best, "document": _merge_chunks(parts), "metadata": metadata})
+        expanded_all.append(expanded)
+    return expanded_all
+
+
+_shard_executor: ThreadPoolExecutor | None = None
+
+
+def _get_shard_executor() -> ThreadPoolExecutor:
+    # Separate from the async API's pool: a search running there waits on these tasks
+    global _shard_executor
+    if _shard_executor is None:
+        with _lock:
+            if _shard_executor is None:
+                _shard_executor = ThreadPoolExecutor(max(1, len(SEARCH_COLLECTIONS)), thread_name_prefix="shard")
+    return _shard_executor
+
+
+def _fan_out(op, names: list[str | None]) -> list:
+    """Run op(name) for every shard, concurrently when there are several.
+
+    Shards that do not exist (never ingested) are skipped, unless none exist.
+    """
+    def run(name: str | None) -> list[list[dict]] | None:
+        try:
+            return op(name)
+        except chromadb.errors.NotFoundError:
+            if len(names) == 1:
+                raise
+            return None
+
+    if len(names) == 1:
+        results = [run(names[0])]
+    else:
+        results = list(_get_shard_executor().map(run, names))
+    found = [r for r in results if r is not None]
+    if not found:
+        raise chromadb.errors.NotFoundError(f"None of the collections {names} exist; run ingest.py first")
+    return found
+
+
+def _merge_shards(
+    per_shard: list[tuple[list[list[dict]], list[list[dict]] | None]], n_queries: int, n_candidates: int
+) -> list[list[dict]]:
+    """One global ranking per query out of each shard's (vector hits, BM25 hits or None).
+
+    Vector candidates of all shards are merged by similarity (same model, same
+    space, so comparable across shards) and BM25 candidates by BM25 score (each
+    shard scores with corpus-wide IDF / document length, see _keyword_hits);
+    when any shard has BM25 hits, the two global lists are then fused once with
+    RRF, keeping the n_candidates best of each. Fusing per shard instead would
+    put every shard's own best hit near the top, however weak.
+    """
+    merged = []
+    for q in range(n_queries):
+        vector = [hit for hits, _ in per_shard for hit in hits[q]]
+        vector.sort(key=lambda hit: hit["score"], reverse=True)
+        keyword_lists = [keyword[q] for _, keyword in per_shard if keyword is not None]
+        if not keyword_lists:
+            merged.append(vector)
+            continue
+        keyword = [hit for hits in keyword_lists for hit in hits]
+        keyword.sort(key=lambda hit: hit["bm25"], reverse=True)
+        merged.append(_fuse(vector[:n_candidates], keyword[:n_candidates]))
+    return merged
+
+
+def _expand_shards(all_hits: list[list[dict]], window: int, collection: chromadb.Collection | None) -> list[list[dict]]:
+    """_expand() per shard (neighbours live in the hit's own collection), keeping the global order."""
+    if collection is not None:
+        return _with_collection(lambda col: _expand(col, all_hits, window), collection)
+    rank = [{(hit["collection"], hit["id"]): i for i, hit in enumerate(hits)} for hits in all_hits]
+    expanded: list[list[dict]] = [[] for _ in all_hits]
+    for name in dict.fromkeys(hit["collection"] for hits in all_hits for hit in hits):
+        shard_hits = [[hit for hit in hits if hit["collection"] == name] for hits in all_hits]
+        shard_expanded = _with_collection(lambda col: _expand(col, shard_hits, window), name=name)
+        for q, passages in enumerate(shard_expanded):
+            expanded[q].extend(passages)
+    for q, passages in enumerate(expanded):
+        passages.sort(key=lambda hit: rank[q][(hit["collection"], hit["id"])])
+    return expanded
+
+
+def _search(
+    queries: list[str],
+    top_k: int,
+    collection: chromadb.Collection | None = None,
+    mode: str = SEARCH_MODE,
+    rerank: bool = RERANK,
+    min_score: float = MIN_SCORE,
+    expand: int = EXPAND_NEIGHBORS,
+    mmr: bool = MMR,
+    sources: list[str] | None = None,
+    tags: list[str] | None = None,
+) -> list[list[dict]]:
+    """Return the raw hits for each query: [{"id", "document", "metadata", "distance", "score", "collection"}].
+
+    collection defaults to the SEARCH_COLLECTIONS shards: each is searched in its
+    own thread and the candidates are merged into one global ranking (_merge_shards).
+    eval.py passes scratch collections instead.
+    mode="hybrid" fuses in BM25 (RRF, once over all shards) for every shard that has a BM25 index.
+    rerank=True over-fetches RERANK_CANDIDATES and reorders them with _rerank(),
+    unless retrieval alone already used up RERANK_BUDGET_MS.
+    Hits with score (similarity) below min_score are dropped.
+    mmr=True over-fetches MMR_CANDIDATES and picks a diverse top_k with _mmr().
+    sources (file names) / tags (TOPIC_TAGS) restrict the search to matching chunks
+    before ranking; within each list any match counts, across the two both must.
+    expand > 0 merges each remaining hit with its neighbouring chunks (_expand).
+    """
+    if not queries:
+        return []
+    started = time.perf_counter()
+    embeddings = _embed_queries(queries)
+    where = _where(sources, tags)
+    use_bm25 = collection is None and (mode == "hybrid" or rerank)
+    first_k = max(RERANK_CANDIDATES, top_k) if rerank else top_k
+    if mmr:
+        first_k = max(MMR_CANDIDATES, first_k)
+    n_candidates = max(top_k * HYBRID_CANDIDATES_FACTOR, first_k)
+    names = [None] if collection is not None else SEARCH_COLLECTIONS
+    # BM25 statistics of all shards, so every shard's BM25 scores are on one scale
+    corpus = [index for index in map(_get_bm25, names) if index is not None] if use_bm25 else None
+
+    def first_stage(name: str | None) -> tuple[list[list[dict]], list[list[dict]] | None]:
+        bm25 = _get_bm25(name) if use_bm25 else None
+
+        def run(col: chromadb.Collection) -> tuple[list[list[dict]], list[list[dict]] | None]:
+            if bm25 is None or mode != "hybrid":
+                vector_hits = _query(col, embeddings, first_k, with_embeddings=mmr, where=where)
+                keyword_hits = None
+            else:
+                vector_hits = _query(col, embeddings, n_candidates, with_embeddings=mmr, where=where)
+                keyword_hits = _keyword_hits(col, queries, embeddings, vector_hits, bm25, n_candidates, where, corpus)
+            space = (col.configuration.get("hnsw") or {}).get("space", "l2")
+            for hits in vector_hits + (keyword_hits or []):
+                for hit in hits:
+                    hit["score"] = _similarity(space, hit["distance"])
+                    hit["collection"] = name
+            return vector_hits, keyword_hits
+
+        return _with_collection(run, collection, name)
+
+    all_hits = _merge_shards(_fan_out(first_stage, names), len(queries), n_candidates)
+    # Rerank weighs query terms by IDF; the first shard's BM25 stands in for the corpus
+    bm25 = _get_bm25(names[0]) if use_bm25 else None
+
+    if rerank:
+        deadline = started + RERANK_BUDGET_MS / 1000
+        for i, (query, hits) in enumerate(zip(queries, all_hits)):
+            if time.perf_counter() > deadline:
+                # Over budget: keep first-stage order for the remaining queries
+                _stats["rerank_skipped"] += len(queries) - i
+                break
+            all_hits[i] = _rerank(query, hits[:first_k], bm25)
+            _stats["rerank_runs"] += 1
+
+    all_hits = [[hit for hit in hits[:first_k] if hit["score"] >= min_score] for hits in all_hits]
+    all_hits = [_mmr(hits, top_k) if mmr else hits[:top_k] for hits in all_hits]
+    for hits in all_hits:
+        for hit in hits:
+            hit.pop("embedding", None)
+            hit.pop("bm25", None)
+    if expand > 0:
+        all_hits = _expand_shards(all_hits, expand, collection)
+    return all_hits
+
+
+def _format_hits(hits: list[dict]) -> str:
+    if not hits:
         return "知识库中没有找到相关内容。"
 
     parts = []
-    for doc, meta, dist in zip(docs, metas, distances):
-        source = meta.get("source", "unknown")
-        similarity = round(1 - dist, 3)  # ChromaDB L2 distance → rough similarity
-        parts.append(f"[来源: {source} | 相关度: {similarity}]\n{doc}")
+    for hit in hits:
+        source = hit["metadata"].get("source", "unknown")
+        parts.append(f"[来源: {source} | 相关度: {hit['score']:.3f}]\n{hit['document']}")
 
     return "\n\n---\n\n".join(parts)
 
 
+def search_notes(
+    query: str,
+    top_k: int = 3,
+    mode: str = SEARCH_MODE,
+    rerank: bool = RERANK,
+    min_score: float = MIN_SCORE,
+    expand: int = EXPAND_NEIGHBORS,
+    mmr: bool = MMR,
+    sources: list[str] | None = None,
+    tags: list[str] | None = None,
+) -> str:
+    """Search the local notes ChromaDB by semantic similarity (+ BM25 in hybrid mode).
+
+    Returns a formatted string of up to top-k passages scoring at least min_score,
+    with their sources and similarity. With expand=N each passage also carries
+    its N neighbouring chunks on either side. sources / tags limit the search to
+    those note files / topic tags.
+    The query is embedded with the same local model as ingest (cached per normalized text).
+    """
+    options = dict(mode=mode, rerank=rerank, min_score=min_score, expand=expand, mmr=mmr, sources=sources, tags=tags)
+    return search_notes_batch([query], top_k=top_k, **options)[0]
+
+
+def _ranking_settings() -> dict:
+    """Process-level settings that change search results; part of the result cache key.
+
+    RESULT_CACHE_DB is shared between processes (loadgen, benchmark runs) that
+    may run with different settings, so they must not serve each other's results.
+    """
+    return {
+        "backend": SEARCH_BACKEND,
+        "numpy_max_chunks": NUMPY_MAX_CHUNKS,
+        "quantization": VECTOR_QUANTIZATION,
+        "rescore": QUANTIZED_RESCORE,
+        "hybrid_factor": HYBRID_CANDIDATES_FACTOR,
+        "rrf_k": RRF_K,
+        "rerank_candidates": RERANK_CANDIDATES,
+        "rerank_weight": RERANK_WEIGHT,
+        "rerank_budget_ms": RERANK_BUDGET_MS,
+        "mmr_candidates": MMR_CANDIDATES,
+        "mmr_lambda": MMR_LAMBDA,
+    }
+
+
+def search_notes_batch(
+    queries: list[str],
+    top_k: int = 3,
+    mode: str = SEARCH_MODE,
+    rerank: bool = RERANK,
+    min_score: float = MIN_SCORE,
+    expand: int = EXPAND_NEIGHBORS,
+    mmr: bool = MMR,
+    sources: list[str] | None = None,
+    tags: list[str] | None = None,
+) -> list[str]:
+    """Search several queries at once.
+
+    All queries are embedded in one model batch and sent to Chroma in one
+    query call. Returns one formatted string per query, same shape as search_notes().
+    Queries answered before (same options and search settings, same collection
+    version) come from the result cache and skip the search entirely.
+    """
+    queries = list(queries)
+    # Filters are sorted so that their order does not split cache entries
+    sources, tags = (sorted(sources) if sources else None), (sorted(tags) if tags else None)
+    options = dict(mode=mode, rerank=rerank, min_score=min_score, expand=expand, mmr=mmr, sources=sources, tags=tags)
+    if not _result_cache.enabled:
+        return [_format_hits(hits) for hits in _search(queries, top_k, **options)]
+
+    # Version stamps change on every re-ingest, so stale entries are never hit
+    versions = ",".join(f"{name}:{_read_version(name)}" for name in SEARCH_COLLECTIONS)
+    settings = {**options, **_ranking_settings()}
+    prefix = f"{versions}|{top_k}|" + "|".join(f"{k}={v}" for k, v in settings.items()) + "|"
+    keys = [text_key(prefix + normalize_query(q)) for q in queries]
+    cached = _result_cache.get_many(keys)
+
+    first_index: dict[str, int] = {}
+    for i, k in enumerate(keys):
+        if k not in cached:
+            first_index.setdefault(k, i)
+    todo = list(first_index.values())
+    if todo:
+        fresh = _search([queries[i] for i in todo], top_k, **options)
+        new = {keys[i]: _format_hits(hits) for i, hits in zip(todo, fresh)}
+        _result_cache.put_many(new)
+        cached.update(new)
+    return [cached[k] for k in keys]
+
+
+# ---------------------------------------------------------------------------
+# Async API
+# ---------------------------------------------------------------------------
+# ONNX and Chroma calls block, so the coroutines hand the sync search to a
+# bounded thread pool instead of running it on the event loop.
+_executor: ThreadPoolExecutor | None = None
+_semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max(1, RETRIEVER_THREADS), thread_name_prefix="retriever")
+    return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    # A semaphore belongs to one event loop, so each loop gets its own
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(max(1, RETRIEVER_MAX_CONCURRENCY))
+    return semaphore
+
+
+async def asearch_notes_batch(
+    queries: list[str],
+    top_k: int = 3,
+    mode: str = SEARCH_MODE,
+    rerank: bool = RERANK,
+    min_score: float = MIN_SCORE,
+    expand: int = EXPAND_NEIGHBORS,
+    mmr: bool = MMR,
+    sources: list[str] | None = None,
+    tags: list[str] | None = None,
+) -> list[str]:
+    """Async search_notes_batch(): same results, without blocking the event loop."""
+    options = dict(mode=mode, rerank=rerank, min_score=min_score, expand=expand, mmr=mmr, sources=sources, tags=tags)
+    call = functools.partial(search_notes_batch, list(queries), top_k=top_k, **options)
+    async with _get_semaphore():
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+async def asearch_notes(
+    query: str,
+    top_k: int = 3,
+    mode: str = SEARCH_MODE,
+    rerank: bool = RERANK,
+    min_score: float = MIN_SCORE,
+    expand: int = EXPAND_NEIGHBORS,
+    mmr: bool = MMR,
+    sources: list[str] | None = None,
+    tags: list[str] | None = None,
+) -> str:
+    """Async search_notes()."""
+    options = dict(mode=mode, rerank=rerank, min_score=min_score, expand=expand, mmr=mmr, sources=sources, tags=tags)
+    return (await asearch_notes_batch([query], top_k=top_k, **options))[0]
+
+
+# ---------------------------------------------------------------------------
+# Warm-up
+# ---------------------------------------------------------------------------
+def warm_up() -> dict[str, float]:
+    """Pay the one-off startup costs before the first real question.
+
+    Loads the query model, opens every collection in SEARCH_COLLECTIONS (plus its
+    BM25 / NumPy index) and runs one throwaway search through the full pipeline.
+    Returns the milliseconds spent per step and the number of collections opened.
+    Cheap to call again: everything it loads stays cached.
+    """
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+    _load_query_model()
+    timings["model_ms"] = (time.perf_counter() - started) * 1000
+
+    step = time.perf_counter()
+    opened = 0
+    for name in SEARCH_COLLECTIONS:
+        try:
+            _get_store(name)
+            _get_bm25(name)
+            opened += 1
+        except chromadb.errors.NotFoundError:
+            continue
+    timings["collections"] = opened
+    timings["collections_ms"] = (time.perf_counter() - step) * 1000
+
+    step = time.perf_counter()
+    if opened:
+        # Not through the result cache: this is about loading segments, not answers
+        _search(["warm up"], top_k=1)
+    timings["query_ms"] = (time.perf_counter() - step) * 1000
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
+    return timings
+
+
 # --- Tool schema for OpenAI function calling ---
 SEARCH_TOOL_SCHEMA = {
     "type": "function",
@@ -82,6 +950,16 @@ SEARCH_TOOL_SCHEMA = {
                     "description": "返回的相关片段数量，默认 3，最大 5",
                     "default": 3,
                 },
+                "sources": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "只在这些笔记文件中检索，例如 [\"03-langgraph.md\"]；不确定时不要填",
+                },
+                "tags": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": TOPIC_TAGS},
+                    "description": "只检索带这些主题标签的片段（任一匹配即可）；不确定时不要填",
+                },
             },
             "required": ["query"],
         },
@@ -89,11 +967,24 @@ SEARCH_TOOL_SCHEMA = {
 }
 
 
+def _tool_filters(args: dict) -> dict:
+    """sources / tags from LLM tool arguments; unknown tags are dropped rather than failing the call."""
+    tags = [t for t in args.get("tags") or [] if t in TOPIC_TAGS]
+    return {"sources": list(args.get("sources") or []) or None, "tags": tags or None}
+
+
 def run_search_tool(args: dict) -> str:
     """Dispatcher called by the agent when the LLM requests this tool."""
     query = args.get("query", "")
     top_k = int(args.get("top_k", 3))
-    return search_notes(query, top_k=top_k)
+    return search_notes(query, top_k=top_k, **_tool_filters(args))
+
+
+async def arun_search_tool(args: dict) -> str:
+    """Async run_search_tool()."""
+    query = args.get("query", "")
+    top_k = int(args.get("top_k", 3))
+    return await asearch_notes(query, top_k=top_k, **_tool_filters(args))
 
 
 if __name__ == "__main__":
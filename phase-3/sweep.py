@@ -0,0 +1,191 @@
+"""
+Phase 3 - Chunking / top_k parameter sweep
+
+Usage:
+    uv run python phase-3/sweep.py
+    uv run python phase-3/sweep.py --chunk-sizes 300,500,800 --overlaps 0,100 --top-k 3,5 --workers 4
+    # Keep chunk embeddings between runs and write the table as JSON:
+    uv run python phase-3/sweep.py --cache-db phase-3/chroma_meta/sweep_cache.sqlite --report sweep.json
+
+What it does:
+    For every (CHUNK_SIZE, CHUNK_OVERLAP) pair it chunks notes/ with the fixed
+    chunker, builds a throwaway ChromaDB collection in its own temporary
+    directory, and for every top_k runs the eval.py QA set against it.
+    Prints one row per (chunk size, overlap, top_k): chunks, index size on
+    disk, hit rate / Recall@k / MRR and search latency (p50 / p95).
+
+    Nothing touches phase-3/chroma_db, and nothing needs re-ingesting:
+    1. All configurations are chunked first (cheap), and the union of their
+       chunk texts is embedded once. Configurations share chunks (the first
+       window of a file is the same for every overlap, short sections fit in
+       one window whatever the size), and identical text is never embedded
+       twice. With --cache-db the vectors persist across sweeps, too.
+    2. Collections are then built and evaluated in parallel (--workers threads).
+       Latencies are measured while other configurations run; use --workers 1
+       when the latency columns matter more than wall time.
+
+    Scores are vector-only (no BM25 / rerank), like eval.py --compare-chunkers,
+    so they isolate the effect of chunking.
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import chromadb
+
+import ingest
+import retriever
+from cache import EmbeddingCache
+from eval import QA_PAIRS, _percentile, _relevance
+
+# Chroma rejects add() calls above its max batch size (~5k on SQLite)
+ADD_BATCH = 4000
+
+
+def _parse_ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def chunk_configs(sizes: list[int], overlaps: list[int]) -> dict[tuple[int, int], list[tuple[str, str, dict]]]:
+    """(chunk_size, overlap) -> chunk records of notes/; pairs with overlap >= size are skipped."""
+    files = [(f, f.read_text(encoding="utf-8")) for f in sorted(ingest.NOTES_DIR.glob("*.md"))]
+    configs = {}
+    for size, overlap in itertools.product(sizes, overlaps):
+        if not 0 <= overlap < size:
+            print(f"[sweep] skip chunk_size={size}, overlap={overlap} (need 0 <= overlap < chunk_size)")
+            continue
+        configs[(size, overlap)] = [
+            record for md_file, text in files for record in ingest.iter_file_chunks(md_file, text, "fixed", size, overlap)
+        ]
+    return configs
+
+
+def embed_unique(texts: list[str], cache: EmbeddingCache, batch_size: int = ingest.INGEST_BATCH_SIZE) -> dict:
+    """text -> embedding for every distinct text, embedding only cache misses."""
+    unique = list(dict.fromkeys(texts))
+    vectors = {}
+    for i in range(0, len(unique), batch_size):
+        batch = unique[i : i + batch_size]
+        vectors.update(zip(batch, cache.get_many(batch, ingest._model)))
+    return vectors
+
+
+def evaluate_config(
+    size: int, overlap: int, records: list, vectors: dict, top_ks: list[int], workdir: Path
+) -> list[dict]:
+    """Build one temporary collection and score it for every top_k."""
+    path = workdir / f"size{size}-overlap{overlap}"
+    client = chromadb.PersistentClient(path=str(path))
+    collection = client.create_collection(
+        "sweep", configuration={"hnsw": {"space": ingest.DISTANCE_SPACE}}, embedding_function=None
+    )
+    started = time.perf_counter()
+    for i in range(0, len(records), ADD_BATCH):
+        batch = records[i : i + ADD_BATCH]
+        collection.add(
+            ids=[r[0] for r in batch],
+            documents=[r[1] for r in batch],
+            metadatas=[r[2] for r in batch],
+            embeddings=[vectors[r[1]] for r in batch],
+        )
+    build_s = time.perf_counter() - started
+    index_bytes = _dir_bytes(path)
+
+    rows = []
+    questions = [q for q, _ in QA_PAIRS]
+    for top_k in top_ks:
+        retriever._search(questions[:1], top_k, collection=collection)  # warm the HNSW segment
+        latencies, ranked = [], []
+        for question in questions:
+            t0 = time.perf_counter()
+            ranked.append(retriever._search([question], top_k, collection=collection)[0])
+            latencies.append((time.perf_counter() - t0) * 1000)
+        scores = [_relevance(hits, expected) for hits, (_, expected) in zip(ranked, QA_PAIRS)]
+        rows.append({
+            "chunk_size": size,
+            "overlap": overlap,
+            "top_k": top_k,
+            "chunks": len(records),
+            "chars": sum(len(r[1]) for r in records),
+            "index_mb": index_bytes / 1e6,
+            "build_s": build_s,
+            "hit_rate": sum(rank is not None for rank, _, _ in scores) / len(scores),
+            "recall": sum(recall for _, recall, _ in scores) / len(scores),
+            "mrr": sum(rr for _, _, rr in scores) / len(scores),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+        })
+    return rows
+
+
+def sweep(
+    sizes: list[int],
+    overlaps: list[int],
+    top_ks: list[int],
+    workers: int = 4,
+    cache_db: str | None = None,
+    report_path: str | Path | None = None,
+) -> list[dict]:
+    configs = chunk_configs(sizes, overlaps)
+    all_texts = [r[1] for records in configs.values() for r in records]
+
+    cache = EmbeddingCache(maxsize=len(all_texts) + 1, db_path=cache_db, namespace="sweep-all-MiniLM-L6-v2")
+    started = time.perf_counter()
+    vectors = embed_unique(all_texts, cache)
+    print(
+        f"[sweep] {len(configs)} configs, {len(all_texts)} chunks, {len(vectors)} distinct texts, "
+        f"{cache.stats['misses']} embedded ({cache.stats['disk_hits']} from --cache-db) "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+    workdir = Path(tempfile.mkdtemp(prefix="sweep-"))
+    try:
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            futures = [
+                pool.submit(evaluate_config, size, overlap, records, vectors, top_ks, workdir)
+                for (size, overlap), records in configs.items()
+            ]
+            rows = [row for future in futures for row in future.result()]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"\n{'size':>5} | {'overlap':>7} | {'top_k':>5} | {'chunks':>6} | {'index MB':>8} | "
+        f"{'hit rate':>8} | {'recall':>6} | {'MRR':>5} | {'p50 ms':>6} | {'p95 ms':>6}"
+    )
+    for row in rows:
+        print(
+            f"{row['chunk_size']:>5} | {row['overlap']:>7} | {row['top_k']:>5} | {row['chunks']:>6} | "
+            f"{row['index_mb']:>8.2f} | {row['hit_rate']:>8.3f} | {row['recall']:>6.3f} | {row['mrr']:>5.3f} | "
+            f"{row['p50_ms']:>6.2f} | {row['p95_ms']:>6.2f}"
+        )
+    if report_path:
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n[sweep] report written to {report_path}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep CHUNK_SIZE / CHUNK_OVERLAP / top_k against the eval QA set")
+    parser.add_argument("--chunk-sizes", type=_parse_ints, default=[300, 500, 800])
+    parser.add_argument("--overlaps", type=_parse_ints, default=[0, 50, 100])
+    parser.add_argument("--top-k", type=_parse_ints, default=[3, 5])
+    parser.add_argument("--workers", type=int, default=4, help="configurations built / evaluated in parallel")
+    parser.add_argument("--cache-db", help="SQLite file that keeps chunk embeddings between sweeps")
+    parser.add_argument("--report", help="also write the rows as JSON")
+    args = parser.parse_args()
+    sweep(args.chunk_sizes, args.overlaps, args.top_k, args.workers, args.cache_db, args.report)
@@ -0,0 +1,171 @@
+"""
+Phase 3 - Synthetic corpus generator for retrieval benchmarks
+
+Usage:
+    # 100k chunks (~2k Markdown files) + 500 labelled questions:
+    uv run python phase-3/synth.py --out /tmp/synth --chunks 100000 --questions 500
+
+    # Then benchmark ingest and search against it (phase-3/chroma_db is shared,
+    # but the corpus gets its own collection, "synth"):
+    INGEST_CORPORA=synth=/tmp/synth uv run python phase-3/ingest.py --full --workers 8
+    SEARCH_COLLECTIONS=synth uv run python phase-3/eval.py --benchmark --qa /tmp/synth/qa.jsonl
+    SEARCH_COLLECTIONS=synth uv run python phase-3/loadgen.py --concurrency 8 --no-cache
+
+What it does:
+    Writes <out>/synth-NNNNNN.md files whose sections are built from the
+    sentences, headings and identifiers of phase-3/notes (mixed Chinese and
+    English), each section sized to about one Markdown-chunker chunk, so
+    --chunks is the approximate chunk count after ingest.
+    --questions sections additionally carry a planted fact about a made-up
+    project ("项目 Orion-000042 的默认端口是 48213。The default port of ..."),
+    and <out>/qa.jsonl lists one question per fact with its source file and
+    answer: the ground truth eval.py --qa scores against.
+
+    Output depends only on --seed, --chunks and --questions, so two runs (or
+    two machines) benchmark the exact same corpus. Files are streamed to disk
+    one at a time; memory stays flat up to 1M chunks.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import time
+from pathlib import Path
+from typing import Iterator
+
+import ingest
+
+# Sections per generated file; --chunks / this = number of files
+SECTIONS_PER_FILE = 50
+# Section body size, kept under CHUNK_TOKENS so a section is about one chunk
+SECTION_TOKENS = int(ingest.CHUNK_TOKENS * 0.8)
+
+_SENTENCE_RE = re.compile(r"[^。！？\n]+[。！？]")
+_LATIN_RE = re.compile(r"[A-Za-z][A-Za-z_]{3,}")
+
+_CODENAMES = ["Orion", "Lyra", "Vega", "Atlas", "Nova", "Cygnus", "Draco", "Hydra", "Pavo", "Tucana"]
+_OWNERS = ["张伟", "李娜", "王芳", "刘洋", "陈静", "Alice", "Bob", "Carol", "Dave", "Erin"]
+# (Chinese attribute, English attribute, value generator)
+_ATTRIBUTES = [
+    ("默认端口", "default port", lambda rng: str(rng.randint(1024, 65535))),
+    ("负责人", "owner", lambda rng: rng.choice(_OWNERS)),
+    ("发布日期", "release date", lambda rng: f"20{rng.randint(18, 29)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"),
+    ("最大并发数", "max concurrency", lambda rng: str(rng.choice([8, 16, 32, 64, 128, 256]))),
+    ("超时时间", "timeout", lambda rng: f"{rng.randint(1, 120)} 秒"),
+]
+_EN_TEMPLATES = [
+    "The {a} step hands the {b} result to {c} before {d} runs.",
+    "In practice {a} and {b} are configured together with {c}.",
+    "When {a} fails, the agent retries with {b} and logs {c}.",
+    "Keep {a} small: {b} and {c} both depend on it.",
+]
+
+
+def _source_pools() -> tuple[list[str], list[str], list[str]]:
+    """(sentences, headings, latin terms) harvested from phase-3/notes."""
+    sentences, headings, terms = [], [], set()
+    for md_file in sorted(ingest.NOTES_DIR.glob("*.md")):
+        for line in md_file.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line.startswith("#"):
+                headings.append(line.lstrip("#").strip())
+            elif line and not line.startswith(("|", "```", "-", ">")):
+                sentences.extend(_SENTENCE_RE.findall(line))
+            terms.update(_LATIN_RE.findall(line))
+    return sentences, headings, sorted(terms)
+
+
+def _paragraph(rng: random.Random, sentences: list[str], terms: list[str], max_tokens: int) -> str:
+    """Random Chinese sentences interleaved with English ones, up to about max_tokens."""
+    parts: list[str] = []
+    tokens = 0
+    while tokens < max_tokens:
+        if rng.random() < 0.3:
+            a, b, c, d = rng.sample(terms, 4)
+            part = rng.choice(_EN_TEMPLATES).format(a=a, b=b, c=c, d=d)
+        else:
+            part = rng.choice(sentences)
+        parts.append(part)
+        tokens += ingest.estimate_tokens(part)
+    return " ".join(parts)
+
+
+def _fact(rng: random.Random, index: int) -> tuple[str, str, str, str]:
+    """(heading, passage, question, answer) for one planted fact."""
+    project = f"{_CODENAMES[index % len(_CODENAMES)]}-{index:06d}"
+    attr_zh, attr_en, value_fn = _ATTRIBUTES[index % len(_ATTRIBUTES)]
+    value = value_fn(rng)
+    passage = f"项目 {project} 的{attr_zh}是 {value}。The {attr_en} of project {project} is {value}."
+    if rng.random() < 0.5:
+        question = f"项目 {project} 的{attr_zh}是什么？"
+    else:
+        question = f"What is the {attr_en} of project {project}?"
+    return f"项目 {project} 配置说明", passage, question, value
+
+
+def iter_files(chunks: int, questions: int, seed: int = 0) -> Iterator[tuple[str, str, list[dict]]]:
+    """Yield (file name, Markdown text, qa records planted in it), deterministically."""
+    rng = random.Random(seed)
+    sentences, headings, terms = _source_pools()
+    n_files = max(1, -(-chunks // SECTIONS_PER_FILE))
+    total_sections = n_files * SECTIONS_PER_FILE
+    questions = min(questions, total_sections)
+    # Planted facts spread evenly over all sections
+    planted = {i * total_sections // questions: i for i in range(questions)} if questions else {}
+
+    for f in range(n_files):
+        name = f"synth-{f:06d}.md"
+        parts = [f"# {rng.choice(headings)} ({f})"]
+        qa = []
+        for s in range(SECTIONS_PER_FILE):
+            fact = planted.get(f * SECTIONS_PER_FILE + s)
+            body = _paragraph(rng, sentences, terms, SECTION_TOKENS)
+            if fact is None:
+                parts.append(f"## {rng.choice(headings)} {f}.{s}\n\n{body}")
+                continue
+            heading, passage, question, answer = _fact(rng, fact)
+            # The fact sits mid-paragraph so it is not trivially the chunk's first line
+            split = len(body) // 2
+            parts.append(f"## {heading}\n\n{body[:split]} {passage} {body[split:]}")
+            qa.append({"question": question, "source": name, "answer": answer, "heading": heading})
+        yield name, "\n\n".join(parts) + "\n", qa
+
+
+def generate(out_dir: str | Path, chunks: int = 10000, questions: int = 200, seed: int = 0) -> Path:
+    """Write the corpus and <out_dir>/qa.jsonl; returns the qa.jsonl path."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in out_dir.glob("synth-*.md"):
+        stale.unlink()
+    qa_path = out_dir / "qa.jsonl"
+    started = time.perf_counter()
+    n_files = n_bytes = n_questions = 0
+    with qa_path.open("w", encoding="utf-8") as qa_file:
+        for name, text, qa in iter_files(chunks, questions, seed):
+            data = text.encode("utf-8")
+            (out_dir / name).write_bytes(data)
+            for record in qa:
+                qa_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            n_files += 1
+            n_bytes += len(data)
+            n_questions += len(qa)
+            if n_files % 200 == 0:
+                print(f"[synth] {n_files} files, {n_bytes / 1e6:.1f} MB")
+    print(
+        f"[synth] Done! {n_files} files (~{n_files * SECTIONS_PER_FILE} chunks, {n_bytes / 1e6:.1f} MB), "
+        f"{n_questions} questions -> {qa_path} in {time.perf_counter() - started:.1f}s"
+    )
+    return qa_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic notes corpus with labelled questions")
+    parser.add_argument("--out", required=True, help="output directory for the .md files and qa.jsonl")
+    parser.add_argument("--chunks", type=int, default=10000, help="approximate chunk count after ingest")
+    parser.add_argument("--questions", type=int, default=200, help="planted facts / labelled questions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out, args.chunks, args.questions, args.seed)
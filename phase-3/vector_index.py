@@ -0,0 +1,374 @@
+"""
+Phase 3 - In-memory NumPy vector index (exact search for small corpora)
+
+This module exposes:
+    - NumpyIndex                    (exact top-k over one float32 matrix)
+    - QuantizedVectors              (int8 / binary copy of the matrix for a cheap first pass)
+    - export_collection(...)        (dump a Chroma collection to .npy + .jsonl, used by ingest.py)
+
+Why brute force?
+    For a few hundred (or a few thousand) chunks, one matrix-vector product
+    over a contiguous float32 matrix is faster than going through Chroma's
+    SQLite + HNSW stack, and it is exact instead of approximate.
+
+NumpyIndex implements the small part of chromadb.Collection the retriever
+uses (query / get / count / configuration, and the where operators the
+retriever builds: $and / $or / $eq / $ne / $in / $nin), so it can be swapped
+in for the collection without touching the search code.
+
+Quantized search:
+    With a QuantizedVectors attached, NumpyIndex scores every row on the
+    compressed codes, keeps the best rescore * k candidates and re-ranks only
+    those with the float32 rows. Keep the float matrix memory-mapped and only
+    the codes stay resident: int8 is ~4x smaller than float32, binary ~32x.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Sequence
+
+import chromadb
+import numpy as np
+
+
+def matches(metadata: dict, where: dict | None) -> bool:
+    """Evaluate a Chroma-style where filter against one metadata dict."""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            ok = all(matches(metadata, c) for c in cond)
+        elif key == "$or":
+            ok = any(matches(metadata, c) for c in cond)
+        elif isinstance(cond, dict):
+            (op, value), = cond.items()
+            present = key in metadata
+            actual = metadata.get(key)
+            if op == "$eq":
+                ok = present and actual == value
+            elif op == "$ne":
+                ok = not present or actual != value
+            elif op == "$in":
+                ok = present and actual in value
+            elif op == "$nin":
+                ok = not present or actual not in value
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+        else:
+            ok = key in metadata and metadata[key] == cond
+        if not ok:
+            return False
+    return True
+
+
+# Rows converted / compared per step, so a query never materializes a float copy of all codes
+QUANT_BLOCK = 65536
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+class QuantizedVectors:
+    """Compressed rows of an embedding matrix, for approximate similarity only.
+
+    "int8":   x ~= scale * codes with one symmetric scale per row
+    "binary": the sign of every dimension, 8 per byte; similarity = -hamming distance
+    """
+
+    def __init__(self, kind: str, codes: np.ndarray, scales: np.ndarray | None = None):
+        if kind not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization: {kind!r} (expected 'int8' or 'binary')")
+        self.kind = kind
+        self.codes = codes
+        self.scales = scales
+        self.norms = None
+        if kind == "int8":
+            # Approximate row norms, so cosine does not need the float rows
+            self.norms = np.empty(len(codes), dtype=np.float32)
+            for i in range(0, len(codes), QUANT_BLOCK):
+                block = codes[i : i + QUANT_BLOCK].astype(np.float32)
+                block_norms = np.sqrt(np.einsum("ij,ij->i", block, block))
+                self.norms[i : i + QUANT_BLOCK] = scales[i : i + QUANT_BLOCK] * block_norms
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray, kind: str) -> "QuantizedVectors":
+        """Quantize block by block, so a memory-mapped matrix is never loaded whole."""
+        n, dim = matrix.shape
+        if kind == "binary":
+            codes = np.empty((n, (dim + 7) // 8), dtype=np.uint8)
+            for i in range(0, n, QUANT_BLOCK):
+                codes[i : i + QUANT_BLOCK] = np.packbits(np.asarray(matrix[i : i + QUANT_BLOCK]) > 0, axis=1)
+            return cls(kind, codes)
+        codes = np.empty((n, dim), dtype=np.int8)
+        scales = np.empty(n, dtype=np.float32)
+        for i in range(0, n, QUANT_BLOCK):
+            block = np.asarray(matrix[i : i + QUANT_BLOCK], dtype=np.float32)
+            scale = np.abs(block).max(axis=1) / 127 if len(block) else np.zeros(0, np.float32)
+            scale[scale == 0] = 1.0
+            codes[i : i + QUANT_BLOCK] = np.rint(block / scale[:, None]).astype(np.int8)
+            scales[i : i + QUANT_BLOCK] = scale
+        return cls(kind, codes, scales)
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        with open(path.with_suffix(".tmp"), "wb") as f:
+            if self.scales is None:
+                np.savez(f, codes=self.codes)
+            else:
+                np.savez(f, codes=self.codes, scales=self.scales)
+        path.with_suffix(".tmp").replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path, kind: str) -> "QuantizedVectors":
+        with np.load(path) as data:
+            return cls(kind, data["codes"], data["scales"] if "scales" in data else None)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, queries: np.ndarray, cosine: bool = False) -> np.ndarray:
+        """(n_queries, n_rows) approximate similarity, higher is better."""
+        out = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        if self.kind == "binary":
+            bits = np.packbits(queries > 0, axis=1)
+            for i in range(0, len(self.codes), QUANT_BLOCK):
+                block = self.codes[i : i + QUANT_BLOCK]
+                for q, qbits in enumerate(bits):
+                    # Signed sum: negating the unsigned popcount total would wrap around
+                    out[q, i : i + QUANT_BLOCK] = -_POPCOUNT[block ^ qbits].sum(axis=1, dtype=np.int32)
+            return out
+        for i in range(0, len(self.codes), QUANT_BLOCK):
+            block = self.codes[i : i + QUANT_BLOCK].astype(np.float32)
+            out[:, i : i + QUANT_BLOCK] = (queries @ block.T) * self.scales[i : i + QUANT_BLOCK]
+        if cosine:
+            out /= np.maximum(self.norms, 1e-12)
+        return out
+
+
+def quantized_path(vectors_path: str | Path, kind: str) -> Path:
+    """notes.vectors.npy -> notes.vectors.int8.npz (or .binary.npz)."""
+    return Path(vectors_path).with_suffix(f".{kind}.npz")
+
+
+class NumpyIndex:
+    """Exact nearest neighbours over rows of a float32 matrix (optionally memory-mapped).
+
+    With quantized set, queries shortlist rescore * k rows on the codes first.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        documents: list[str],
+        metadatas: list[dict],
+        matrix: np.ndarray,
+        space: str = "l2",
+        quantized: QuantizedVectors | None = None,
+        rescore: int = 4,
+    ):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.matrix = matrix
+        self.space = space
+        self.quantized = quantized
+        self.rescore = max(1, rescore)
+        self.configuration = {"hnsw": {"space": space}}
+        self._rows = {doc_id: i for i, doc_id in enumerate(ids)}
+        self._sq_norms_cache: np.ndarray | None = None
+
+    @property
+    def _sq_norms(self) -> np.ndarray:
+        # Row norms are needed for cosine / l2 on the full matrix; computed once.
+        # Quantized search never needs them (it only touches the shortlisted rows).
+        if self._sq_norms_cache is None:
+            self._sq_norms_cache = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        return self._sq_norms_cache
+
+    @classmethod
+    def load(
+        cls,
+        vectors_path: str | Path,
+        rows_path: str | Path,
+        space: str,
+        mmap: bool = False,
+        quantization: str | None = None,
+        rescore: int = 4,
+    ) -> "NumpyIndex":
+        """Load an export; quantization="int8" / "binary" also loads those codes.
+
+        Quantized indexes always memory-map the float matrix: it is only read
+        for the shortlisted rows.
+        """
+        quantized = None
+        if quantization:
+            quantized = QuantizedVectors.load(quantized_path(vectors_path, quantization), quantization)
+            mmap = True
+        matrix = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        ids, documents, metadatas = [], [], []
+        with open(rows_path, encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                ids.append(row["id"])
+                documents.append(row["document"])
+                metadatas.append(row["metadata"])
+        return cls(ids, documents, metadatas, matrix, space, quantized, rescore)
+
+    @classmethod
+    def from_collection(cls, collection: chromadb.Collection, page_size: int = 1000) -> "NumpyIndex":
+        ids, documents, metadatas, vectors = [], [], [], []
+        offset = 0
+        while True:
+            page = collection.get(
+                limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"]
+            )
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            documents.extend(page["documents"])
+            metadatas.extend(m or {} for m in page["metadatas"])
+            vectors.extend(page["embeddings"])
+            offset += len(page["ids"])
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        space = (collection.configuration.get("hnsw") or {}).get("space", "l2")
+        return cls(ids, documents, metadatas, np.ascontiguousarray(matrix), space)
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _mask(self, where: dict | None) -> np.ndarray | None:
+        if not where:
+            return None
+        return np.fromiter((matches(m, where) for m in self.metadatas), dtype=bool, count=len(self.ids))
+
+    def _distances(self, queries: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        """(n_queries, n_rows) distances, matching what Chroma reports for self.space.
+
+        rows limits the computation to those rows (in that order).
+        """
+        if rows is None:
+            matrix, sq_norms = self.matrix, None
+        else:
+            matrix = np.asarray(self.matrix[rows], dtype=np.float32)
+            sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        dots = queries @ matrix.T
+        if self.space == "ip":
+            return 1 - dots
+        if sq_norms is None:
+            sq_norms = self._sq_norms
+        q_sq = np.einsum("ij,ij->i", queries, queries)[:, None]
+        if self.space == "cosine":
+            return 1 - dots / np.maximum(np.sqrt(q_sq * sq_norms[None, :]), 1e-12)
+        return np.maximum(q_sq + sq_norms[None, :] - 2 * dots, 0.0)  # squared L2
+
+    def _top_rows(self, queries: np.ndarray, k: int, mask: np.ndarray | None) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Per query: (rows, distances) of the k nearest rows, nearest first."""
+        top = []
+        if self.quantized is None:
+            distances = self._distances(queries)
+            if mask is not None:
+                distances[:, ~mask] = np.inf  # filtered rows sort last and k never reaches them
+            # argpartition finds the k smallest in O(n); only those k get sorted
+            for q, rows in enumerate(np.argpartition(distances, k - 1, axis=1)[:, :k]):
+                rows = rows[np.argsort(distances[q, rows])]
+                top.append((rows, distances[q, rows]))
+            return top
+
+        # First pass on the codes, then exact distances for the shortlist only
+        approx = self.quantized.scores(queries, cosine=self.space == "cosine")
+        if mask is not None:
+            approx[:, ~mask] = -np.inf
+        n_candidates = min(k * self.rescore, len(self.ids) if mask is None else int(mask.sum()))
+        for q, rows in enumerate(np.argpartition(-approx, n_candidates - 1, axis=1)[:, :n_candidates]):
+            distances = self._distances(queries[q : q + 1], rows)[0]
+            order = np.argsort(distances)[:k]
+            top.append((rows[order], distances[order]))
+        return top
+
+    def query(
+        self,
+        query_embeddings: Sequence,
+        n_results: int = 10,
+        where: dict | None = None,
+        include: Sequence[str] = ("documents", "metadatas", "distances"),
+    ) -> dict:
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        result: dict = {key: [] for key in ("ids", "documents", "metadatas", "distances", "embeddings")}
+        mask = self._mask(where)
+        allowed = len(self.ids) if mask is None else int(mask.sum())
+        if not allowed:
+            for key in result:
+                result[key] = [[] for _ in range(len(queries))]
+            return result
+
+        for rows, distances in self._top_rows(queries, min(n_results, allowed), mask):
+            result["ids"].append([self.ids[r] for r in rows])
+            result["documents"].append([self.documents[r] for r in rows])
+            result["metadatas"].append([self.metadatas[r] for r in rows])
+            result["distances"].append(distances.tolist())
+            result["embeddings"].append([self.matrix[r] for r in rows] if "embeddings" in include else None)
+        return result
+
+    def get(
+        self,
+        ids: Sequence[str] | None = None,
+        where: dict | None = None,
+        include: Sequence[str] = ("documents", "metadatas"),
+    ) -> dict:
+        if ids is None:
+            rows = range(len(self.ids))
+        else:
+            rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        if where:
+            rows = [r for r in rows if matches(self.metadatas[r], where)]
+        return {
+            "ids": [self.ids[r] for r in rows],
+            "documents": [self.documents[r] for r in rows],
+            "metadatas": [self.metadatas[r] for r in rows],
+            "embeddings": [self.matrix[r] for r in rows] if "embeddings" in include else None,
+        }
+
+
+def export_collection(
+    collection: chromadb.Collection,
+    vectors_path: str | Path,
+    rows_path: str | Path,
+    page_size: int = 1000,
+) -> int:
+    """Write all embeddings to a .npy matrix and ids/documents/metadatas to .jsonl,
+    plus int8 and binary quantized copies of the matrix (see quantized_path).
+
+    Streams page by page: the matrix is filled through a writable memmap, so
+    exporting never holds the whole collection in memory. Returns the row count.
+    """
+    vectors_path, rows_path = Path(vectors_path), Path(rows_path)
+    vectors_path.parent.mkdir(parents=True, exist_ok=True)
+    count = collection.count()
+    first = collection.get(limit=1, include=["embeddings"])
+    dim = len(first["embeddings"][0]) if first["ids"] else 0
+
+    tmp_vectors = vectors_path.with_suffix(".tmp.npy")
+    tmp_rows = rows_path.with_suffix(".tmp")
+    matrix = np.lib.format.open_memmap(tmp_vectors, mode="w+", dtype=np.float32, shape=(count, dim))
+    offset = 0
+    with open(tmp_rows, "w", encoding="utf-8") as f:
+        while offset < count:
+            page = collection.get(
+                limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"]
+            )
+            if not page["ids"]:
+                break
+            n = len(page["ids"])
+            matrix[offset : offset + n] = np.asarray(page["embeddings"], dtype=np.float32)
+            for doc_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                f.write(json.dumps({"id": doc_id, "document": doc, "metadata": meta or {}}, ensure_ascii=False))
+                f.write("\n")
+            offset += n
+    matrix.flush()
+    for kind in ("int8", "binary"):
+        QuantizedVectors.from_matrix(matrix, kind).save(quantized_path(vectors_path, kind))
+    del matrix
+    tmp_vectors.replace(vectors_path)
+    tmp_rows.replace(rows_path)
+    return offset
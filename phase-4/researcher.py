@@ -17,9 +17,8 @@ import json
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
-from tools import ALL_TOOLS, run_tool
+from tools import ALL_TOOLS, get_client, run_tools
 
 load_dotenv()
 
@@ -59,10 +58,7 @@ def research(topic: str, max_tool_calls: int = 4) -> str:
 
     This is basically Phase 1's tool loop, wrapped in a clean function!
     """
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL"),
-    )
+    client = get_client()
 
     messages = [
         {"role": "system", "content": RESEARCHER_SYSTEM_PROMPT},
@@ -100,10 +96,9 @@ def research(topic: str, max_tool_calls: int = 4) -> str:
                 ],
             })
 
-            # Execute each tool and add results
-            for tc in msg.tool_calls:
-                args = json.loads(tc.function.arguments)
-                result = run_tool(tc.function.name, args)
+            # Execute all tools of this turn (knowledge-base searches go out as one batch)
+            calls = [(tc.function.name, json.loads(tc.function.arguments)) for tc in msg.tool_calls]
+            for tc, result in zip(msg.tool_calls, run_tools(calls)):
                 messages.append({
                     "role": "tool",
                     "tool_call_id": tc.id,
@@ -16,46 +16,63 @@ Key insight:
 
 from __future__ import annotations
 
+import asyncio
 import os
 import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
 load_dotenv()
 
+# Shared OpenAI client (one connection pool per process), see utils/llm_client.py
+sys.path.insert(0, str(Path(__file__).parent.parent / "utils"))
+from llm_client import get_client  # noqa: E402,F401
+
 # Reuse Phase 3's retriever
 PHASE3_DIR = Path(__file__).parent.parent / "phase-3"
 sys.path.insert(0, str(PHASE3_DIR))
 
 try:
     from retriever import search_notes as _search_notes  # type: ignore
+    from retriever import search_notes_batch as _search_notes_batch  # type: ignore
+    from retriever import asearch_notes_batch as _asearch_notes_batch  # type: ignore
+    from retriever import TOPIC_TAGS as _TOPIC_TAGS  # type: ignore
     _HAS_PHASE3 = True
 except Exception:
     _HAS_PHASE3 = False
+    _TOPIC_TAGS = []
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "gemini-embedding-001")
 
 
-def get_client() -> OpenAI:
-    return OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL"),
-    )
-
-
 # ---------------------------------------------------------------------------
 # Tool 1: Search Knowledge Base（复用 Phase 3）
 # ---------------------------------------------------------------------------
-def search_knowledge_base(query: str, top_k: int = 3) -> str:
-    """Search the Phase 3 local notes ChromaDB."""
+def search_knowledge_base(query: str, top_k: int = 3, tags: list[str] | None = None) -> str:
+    """Search the Phase 3 local notes ChromaDB (optionally only chunks with these topic tags)."""
     if not _HAS_PHASE3:
         return (
             "[knowledge_base] Phase 3 ChromaDB not found. "
             "Run 'uv run python phase-3/ingest.py' first."
         )
-    return _search_notes(query, top_k=top_k)
+    return _search_notes(query, top_k=top_k, tags=tags)
+
+
+def search_knowledge_base_batch(queries: list[str], top_k: int = 3, tags: list[str] | None = None) -> list[str]:
+    """Search several queries in one retriever round trip."""
+    if not _HAS_PHASE3:
+        return [search_knowledge_base(q, top_k) for q in queries]
+    return _search_notes_batch(queries, top_k=top_k, tags=tags)
+
+
+async def asearch_knowledge_base_batch(
+    queries: list[str], top_k: int = 3, tags: list[str] | None = None
+) -> list[str]:
+    """Async search_knowledge_base_batch(), for agents running inside an event loop."""
+    if not _HAS_PHASE3:
+        return [search_knowledge_base(q, top_k) for q in queries]
+    return await _asearch_notes_batch(queries, top_k=top_k, tags=tags)
 
 
 SEARCH_KB_SCHEMA = {
@@ -68,6 +85,11 @@ SEARCH_KB_SCHEMA = {
             "properties": {
                 "query": {"type": "string", "description": "搜索关键词或问题"},
                 "top_k": {"type": "integer", "description": "返回结果数量", "default": 3},
+                "tags": {
+                    "type": "array",
+                    "items": {"type": "string", **({"enum": _TOPIC_TAGS} if _TOPIC_TAGS else {})},
+                    "description": "只检索这些主题（任一匹配即可）；不确定时不要填",
+                },
             },
             "required": ["query"],
         },
@@ -118,7 +140,55 @@ ALL_TOOLS = [SEARCH_KB_SCHEMA, WEB_SEARCH_SCHEMA]
 
 def run_tool(name: str, args: dict) -> str:
     if name == "search_knowledge_base":
-        return search_knowledge_base(args.get("query", ""), args.get("top_k", 3))
+        return search_knowledge_base(args.get("query", ""), args.get("top_k", 3), _kb_tags(args))
     elif name == "web_search":
         return web_search(args.get("query", ""))
     return f"[tools] Unknown tool: {name}"
+
+
+def _kb_tags(args: dict) -> list[str] | None:
+    # Drop tags the LLM made up instead of failing the whole search
+    return sorted(t for t in args.get("tags") or [] if t in _TOPIC_TAGS) or None
+
+
+def _group_kb_calls(calls: list[tuple[str, dict]], results: list) -> dict[tuple[int, tuple], list[int]]:
+    """Run non-KB calls into results; return KB call indices grouped by (top_k, tags)."""
+    kb_groups: dict[tuple[int, tuple], list[int]] = {}
+    for i, (name, args) in enumerate(calls):
+        if name == "search_knowledge_base":
+            key = (int(args.get("top_k", 3)), tuple(_kb_tags(args) or ()))
+            kb_groups.setdefault(key, []).append(i)
+        else:
+            results[i] = run_tool(name, args)
+    return kb_groups
+
+
+def run_tools(calls: list[tuple[str, dict]]) -> list[str]:
+    """Run all tool calls from one LLM turn, returning results in call order.
+
+    Knowledge-base searches are grouped by (top_k, tags) and sent as one batch each,
+    so an LLM turn with several parallel searches costs one embedding pass.
+    """
+    results: list[str | None] = [None] * len(calls)
+    kb_groups = _group_kb_calls(calls, results)
+    for (top_k, tags), indices in kb_groups.items():
+        queries = [calls[i][1].get("query", "") for i in indices]
+        for i, result in zip(indices, search_knowledge_base_batch(queries, top_k, list(tags) or None)):
+            results[i] = result
+    return results  # type: ignore[return-value]
+
+
+async def arun_tools(calls: list[tuple[str, dict]]) -> list[str]:
+    """Async run_tools(): the knowledge-base batches of one turn run concurrently."""
+    results: list[str | None] = [None] * len(calls)
+    kb_groups = _group_kb_calls(calls, results)
+    batches = await asyncio.gather(
+        *(
+            asearch_knowledge_base_batch([calls[i][1].get("query", "") for i in indices], top_k, list(tags) or None)
+            for (top_k, tags), indices in kb_groups.items()
+        )
+    )
+    for indices, batch in zip(kb_groups.values(), batches):
+        for i, result in zip(indices, batch):
+            results[i] = result
+    return results  # type: ignore[return-value]
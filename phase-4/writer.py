@@ -19,12 +19,17 @@ Separation of concerns:
 from __future__ import annotations
 
 import os
+import sys
+from pathlib import Path
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
 load_dotenv()
 
+# Shared OpenAI client (one connection pool per process), see utils/llm_client.py
+sys.path.insert(0, str(Path(__file__).parent.parent / "utils"))
+from llm_client import get_client  # noqa: E402
+
 CHAT_MODEL = os.getenv("CHAT_MODEL", "MiniMax-M2.5")
 
 WRITER_SYSTEM_PROMPT = """你是一个专业的技术文章写作者，擅长把复杂的技术内容写成清晰易读的文章。
@@ -64,10 +69,7 @@ def write_article(topic: str, research_notes: str, revision_feedback: str = "")
     Returns:
         The article as a Markdown string.
     """
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL"),
-    )
+    client = get_client()
 
     if revision_feedback:
         user_content = (
@@ -0,0 +1,119 @@
+"""
+Shared OpenAI client factory (phase-1 .. phase-4)
+
+Usage:
+    sys.path.insert(0, str(Path(__file__).parent.parent / "utils"))
+    from llm_client import get_client
+
+    client = get_client()   # same client (and connection pool) on every call
+
+Why one client per process?
+    Every OpenAI(...) owns a fresh httpx connection pool. Building one per
+    LLM call (as the agents used to) throws away the TCP + TLS handshake and
+    the keep-alive connection after each hop, so a multi-hop turn
+    (llm_with_tools -> tool -> llm_answer, researcher -> writer -> review)
+    pays the connection setup again on every request. A shared client keeps
+    those connections warm. It is thread-safe, so worker threads can share it.
+
+Config (environment):
+    OPENAI_API_KEY / OPENAI_BASE_URL   as before; one client per (key, base URL)
+    LLM_TIMEOUT            read / write / pool timeout in seconds (default 60)
+    LLM_CONNECT_TIMEOUT    connect timeout in seconds (default 10)
+    LLM_MAX_CONNECTIONS    pool size (default 20)
+    LLM_MAX_KEEPALIVE      idle connections kept open (default 10)
+    LLM_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 30)
+    LLM_MAX_RETRIES        SDK retries on connection errors / 429 / 5xx (default 2)
+    LLM_HTTP2=1            HTTP/2 (multiplexes concurrent requests over one
+                           connection); needs the h2 package, otherwise HTTP/1.1
+
+Smoke check (one chat completion through a stub transport, no network):
+    uv run python utils/llm_client.py
+"""
+
+from __future__ import annotations
+
+import importlib
+import importlib.util
+import os
+import threading
+
+import openai
+from dotenv import load_dotenv
+from openai import DefaultHttpxClient, OpenAI
+
+load_dotenv()
+
+# The HTTP library the SDK is built on: httpx, or its httpx2 fork in newer
+# releases. Pool limits and stub transports must come from that same module.
+_httpx = importlib.import_module(type(openai.DEFAULT_CONNECTION_LIMITS).__module__.split(".")[0])
+
+_lock = threading.Lock()
+_clients: dict[tuple[str | None, str | None], OpenAI] = {}
+
+
+def _build_client(api_key: str | None, base_url: str | None, transport=None) -> OpenAI:
+    """A new OpenAI client with the configured pool; transport replaces the network (smoke check)."""
+    http2 = os.getenv("LLM_HTTP2", "0") == "1" and importlib.util.find_spec("h2") is not None
+    # DefaultHttpxClient keeps the SDK's own defaults (redirects, proxies from env).
+    # Timeouts go to OpenAI(timeout=...) only: the SDK applies its client timeout per
+    # request, and handing it the HTTP client's Timeout nests one Timeout in another.
+    http_client = DefaultHttpxClient(
+        http2=http2,
+        limits=_httpx.Limits(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+        ),
+        **({"transport": transport} if transport is not None else {}),
+    )
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=openai.Timeout(
+            float(os.getenv("LLM_TIMEOUT", "60")), connect=float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+        ),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        http_client=http_client,
+    )
+
+
+def get_client() -> OpenAI:
+    """The process-wide OpenAI client for the current OPENAI_API_KEY / OPENAI_BASE_URL.
+
+    Keys and URLs are read on every call, so a later load_dotenv(override=True)
+    gets a client of its own instead of silently reusing the old credentials.
+    """
+    key = (os.getenv("OPENAI_API_KEY"), os.getenv("OPENAI_BASE_URL"))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _build_client(*key)
+    return client
+
+
+def close_clients() -> None:
+    """Close every pooled connection (the next get_client() builds a new client)."""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+if __name__ == "__main__":
+    # One request through the full SDK stack, answered by a stub transport. The
+    # handler checks what the transport would hand to socket.settimeout().
+    def handler(request):
+        timeouts = request.extensions.get("timeout", {})
+        bad = {k: v for k, v in timeouts.items() if v is not None and not isinstance(v, (int, float))}
+        assert not bad, f"non-numeric socket timeouts: {bad}"
+        return _httpx.Response(200, json={
+            "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "pong"}}],
+        })
+
+    client = _build_client("sk-stub", "http://llm.stub/v1", transport=_httpx.MockTransport(handler))
+    response = client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "ping"}])
+    assert response.choices[0].message.content == "pong"
+    print(f"[llm_client] OK: stub request succeeded (timeout={client.timeout}, via {_httpx.__name__})")